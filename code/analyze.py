@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+import sys
+import csv
+import time
+import logging
+from model import Model
+from slot import MultiSchemeSlotSuite
+from suite_io import get_cell_codes
+
+def iter_chunks (stream, model, chunk_size=10000, dialect="excel"):
+    '''Reads test cases from CSV with header of params (e.g. written by `suite_io.write_csv`) and yields lists of at most `chunk_size` rows
+of value codes in `model.params` order (see `TestCase.codes`). Empty cells, cells out of domains and params, which are not in CSV, are None.
+Cells are matched with domain values by their string form, as in `suite_io.read_csv` (see `suite_io.get_cell_codes`).'''
+    reader = csv.reader(stream, dialect=dialect)
+    header = reader.next()
+    columns = [(i, model.param_positions[par], get_cell_codes(model, par))
+               for i, par in enumerate(header) if model.param_positions.has_key(par)]
+    width = len(model.params)
+    chunk = []
+    for cells in reader:
+        row = [None] * width
+        for i, pos, codes in columns:
+            if i < len(cells):
+                row[pos] = codes.get(cells[i])
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def analyze_csv (stream, model, slots=None, chunk_size=10000, batched=True, processes=None, dialect="excel"):
+    '''Marks slots, covered by an existing suite in CSV `stream`, chunk by chunk (see `MultiSchemeSlotSuite.mark_slots_covered_bulk`),
+so large suites are not kept in memory. `slots` is `MultiSchemeSlotSuite` of the model built beforehand (e.g. by `ModelCache`), it's changed.
+Returns the slots: pass them to `TestSuite.generate_nwise` as `slots` to generate test cases only for uncovered slots, and see `get_report`.'''
+    if slots is None:
+        slots = MultiSchemeSlotSuite(model.get_slot_schemes(), generate=True, model=model, batched=batched, processes=processes)
+    rows = 0
+    start = time.time()
+    for chunk in iter_chunks(stream, model, chunk_size, dialect):
+        slots.mark_slots_covered_bulk(chunk)
+        rows += len(chunk)
+    logging.debug("Analyzed %d test cases in %.3fs", rows, time.time() - start)
+    return slots
+
+def get_report (model, slots, uncovered_limit=None):
+    '''Returns { slot_scheme: report } for analyzed `slots`: numbers of slots in each state (see `MultiSchemeSlotSuite.get_coverage_report`),
+"coverage" (share of covered slots of slots, which need covering) and "uncovered_slots": list of { param: value } of at most `uncovered_limit` uncovered slots.'''
+    report = slots.get_coverage_report()
+    for slot_scheme, suite in slots.iteritems():
+        scheme_report = report[slot_scheme]
+        needed = scheme_report["covered"] + scheme_report["uncovered"]
+        scheme_report["coverage"] = float(scheme_report["covered"]) / needed if needed else 1.0
+        scheme_report["uncovered_slots"] = uncovered = []
+        for index in suite.iter_indexes(0):
+            if uncovered_limit is not None and len(uncovered) >= uncovered_limit:
+                break
+            uncovered.append(dict((par, model.decode(par, code)) for par, code in zip(slot_scheme, suite.get_values(index))))
+    return report
+
+if __name__ == '__main__':
+    # analyze.py model.yaml suite.csv
+    model = Model(open(sys.argv[1]).read())
+    with open(sys.argv[2], "rb") as f:
+        slots = analyze_csv(f, model)
+    for slot_scheme, scheme_report in sorted(get_report(model, slots, 10).iteritems()):
+        print "%s: %d of %d slots are covered (%.1f%%), %d excluded, %d optional" % (
+            ", ".join(slot_scheme), scheme_report["covered"], scheme_report["covered"] + scheme_report["uncovered"],
+            100 * scheme_report["coverage"], scheme_report["excluded"], scheme_report["optional"])
+        for slot in scheme_report["uncovered_slots"]:
+            print "\tuncovered: %s" % ", ".join(["%s=%s" % (par, slot[par]) for par in slot_scheme])
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+import sys
+import math
+import json
+import time
+import random
+import resource
+import itertools as it
+import multiprocessing
+import yaml
+from helpers import __version__
+from instrument import Instrumentation
+from model import Model
+from slot import MultiSchemeSlotSuite
+from proto_alg import TestSuite
+
+# grid of synthetic models: every combination is one benchmark case
+default_grid = {"params": [5, 10, 15],
+                "domain": [2, 3, 4],
+                "scheme": ["__2", "__3", "nested"],
+                "density": [0.0, 0.1, 0.25]}
+
+def get_param_names (count):
+    return ["p%02d" % i for i in xrange(count)]
+
+def build_yaml_model (params, domain, scheme, density, random_seed=0):
+    '''Returns YAML of synthetic model with `params` params of `domain` values each.
+`scheme` is "__2", "__3" or "nested" (pairs of the first half of params and of triples of the other half).
+`density` is a share of params pairs, which get a mandatory constraint forbidding one random pair of values.
+Values of a random test case are never forbidden, so the model always has test cases, which fit its constraints.'''
+    rnd = random.Random(random_seed)
+    names = get_param_names(params)
+    if scheme == "nested":
+        half = params // 2
+        scheme = {"__2": names[:half] + [{"__3": names[half:]}]}
+    else:
+        scheme = {scheme: names}
+    pairs = list(it.combinations(names, 2))
+    witness = dict(zip(names, [rnd.randrange(domain) for par in names])) # the test case, which fits all constraints
+    constraints = []
+    for p1, p2 in sorted(rnd.sample(pairs, int(round(density * len(pairs))))):
+        val1, val2 = witness[p1], witness[p2]
+        while domain > 1 and (val1, val2) == (witness[p1], witness[p2]):
+            val1, val2 = rnd.randrange(domain), rnd.randrange(domain)
+        constraints.append("lambda %s, %s: not (%s == %d and %s == %d)" % (p1, p2, p1, val1, p2, val2))
+    raw_model = {"data": dict((par, range(domain)) for par in names),
+                 "scheme": scheme}
+    if constraints:
+        raw_model["constraints"] = {"mandatory": constraints}
+    return yaml.safe_dump(raw_model)
+
+def get_bounds (model):
+    '''Returns (lower, upper) bounds of covering array size for slot schemes of `model` without constraints.
+Lower bound: number of slots of the largest scheme, each of them needs its own test case.
+Upper bound: Stein-Lovász-Johnson bound for covering array of the largest scheme size over all params with the largest domain.'''
+    slot_schemes = model.get_slot_schemes()
+    if not slot_schemes:
+        return (0, 0)
+    lower = max([reduce(lambda res, par: res * len(model[par]), slot_scheme, 1) for slot_scheme in slot_schemes])
+    t = max(map(len, slot_schemes))
+    k = len(model.params)
+    v = max([len(model[par]) for par in model.params])
+    if v < 2:
+        return (lower, lower)
+    log_combinations = math.lgamma(k + 1) - math.lgamma(t + 1) - math.lgamma(k - t + 1)
+    upper = int(math.ceil((log_combinations + t * math.log(v)) / math.log(float(v ** t) / (v ** t - 1))))
+    return (lower, max(upper, lower))
+
+def run_case (case):
+    '''Runs one benchmark case (dict of `default_grid` keys with `engine` and `random_seed`) and returns dict of results.
+Peak memory is peak RSS of the process, so each case should run in its own process (see `run_benchmark`).'''
+    result = dict(case, version=__version__)
+    yaml_model = build_yaml_model(case["params"], case["domain"], case["scheme"], case["density"], case["random_seed"])
+    result["base_memory_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    instrumentation = Instrumentation()
+    model = Model(yaml_model, instrumentation)
+    result["lower_bound"], result["upper_bound"] = get_bounds(model)
+    try:
+        slots = MultiSchemeSlotSuite(model.get_slot_schemes(), generate=True, model=model, batched=case["batched"])
+        result["slots"] = sum(map(len, slots.itervalues()))
+        result["uncovered_slots"] = slots.uncovered_count()
+        result["slots_time"] = time.time() - start
+        test_suite = TestSuite()
+        test_suite.generate_nwise(model, engine=case["engine"], random_seed=case["random_seed"], slots=slots)
+        result["size"] = len(test_suite)
+        result["ratio_to_lower_bound"] = float(len(test_suite)) / result["lower_bound"] if result["lower_bound"] else None
+        result["error"] = None
+    except Exception, e:
+        result["size"] = result["ratio_to_lower_bound"] = None
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    result["time"] = time.time() - start
+    result["constraint_calls"] = instrumentation.counters.get("constraint_calls", 0)
+    result["timers"] = instrumentation.timers
+    result["peak_memory_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+def get_cases (grid=None, engine="greedy", batched=True, random_seed=0):
+    grid = dict(default_grid, **(grid or {}))
+    keys = sorted(grid)
+    return [dict(zip(keys, values), engine=engine, batched=batched, random_seed=random_seed)
+            for values in it.product(*[grid[key] for key in keys])]
+
+def run_benchmark (cases, stream=None):
+    '''Runs `cases` (see `get_cases`), each in a fresh worker process, and returns list of results.
+If `stream` is given, each result is written to it as a JSON line as soon as it's ready.'''
+    results = []
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for result in pool.imap(run_case, cases):
+            results.append(result)
+            if stream is not None:
+                stream.write(json.dumps(result, sort_keys=True) + "\n")
+                stream.flush()
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+def compare_results (baseline, results, time_tolerance=0.25, size_tolerance=0.0):
+    '''Compares `results` with `baseline` (lists of results of the same cases, e.g. read from files). Returns list of messages about regressions:
+time grown more than by `time_tolerance` share, test suite grown more than by `size_tolerance` share, or a case, which started failing.'''
+    def get_key (result):
+        return tuple([result[key] for key in sorted(default_grid) + ["engine", "batched", "random_seed"]])
+    baseline = dict((get_key(result), result) for result in baseline)
+    messages = []
+    for result in results:
+        old = baseline.get(get_key(result))
+        if old is None:
+            continue
+        name = ", ".join(["%s=%s" % (key, result[key]) for key in sorted(default_grid)])
+        if result["error"] and not old["error"]:
+            messages.append("%s: fails with %s" % (name, result["error"]))
+            continue
+        if result["size"] is not None and old["size"] is not None and result["size"] > old["size"] * (1 + size_tolerance):
+            messages.append("%s: size %d -> %d" % (name, old["size"], result["size"]))
+        if result["time"] > old["time"] * (1 + time_tolerance):
+            messages.append("%s: time %.3fs -> %.3fs" % (name, old["time"], result["time"]))
+    return messages
+
+def read_results (path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+if __name__ == '__main__':
+    # benchmark.py results.jsonl [baseline.jsonl]
+    with open(sys.argv[1], "w") as f:
+        results = run_benchmark(get_cases(), f)
+    if len(sys.argv) > 2:
+        messages = compare_results(read_results(sys.argv[2]), results)
+        print "\n".join(messages) or "No regressions"
+        sys.exit(1 if messages else 0)
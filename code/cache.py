@@ -0,0 +1,81 @@
+#-*- coding: utf-8 -*-
+import os
+import mmap
+import shutil
+import hashlib
+import tempfile
+import cPickle as pickle
+from helpers import __version__
+from model import Model
+from slot import SlotScheme, MultiSchemeSlotSuite, MappedStates
+
+class ModelCache (object):
+    '''On-disk cache of compiled models in `directory`. An entry is keyed by hash of model YAML and library version and keeps:
+  model.pickle -> flattened data, priority, constraint sources, slot schemes and offsets of their states
+  states.bin -> states of all slots of all schemes after constraints marking (excluded and optional slots)
+States are read through memory mapping, so a model, which was generated once, starts without parsing YAML and evaluating constraints over slots.
+The mapping is kept as states of the loaded suites (with copy on write): only pages of touched schemes are read, and only changed pages are copied.'''
+    def __init__ (self, directory):
+        self.directory = directory
+
+    def get_key (self, yaml_model):
+        return hashlib.sha1("%s\0%s" % (__version__, yaml_model)).hexdigest()
+
+    def get_path (self, yaml_model):
+        return os.path.join(self.directory, self.get_key(yaml_model))
+
+    def get (self, yaml_model, batched=True, processes=None):
+        '''Returns (Model, MultiSchemeSlotSuite) for `yaml_model` from cache. If there is no entry, they are built and stored.'''
+        result = self.load(yaml_model)
+        if result is None:
+            model = Model(yaml_model)
+            slots = MultiSchemeSlotSuite(model.get_slot_schemes(), generate=True, model=model,
+                                         batched=batched, processes=processes)
+            self.store(model, slots)
+            result = (model, slots)
+        return result
+
+    def load (self, yaml_model):
+        '''Returns (Model, MultiSchemeSlotSuite) for `yaml_model` or None, if it's not cached.'''
+        path = self.get_path(yaml_model)
+        if not os.path.isdir(path):
+            return None
+        with open(os.path.join(path, "model.pickle"), "rb") as f:
+            compiled = pickle.load(f)
+        model = Model.from_compiled(compiled)
+        slot_schemes = model.get_slot_schemes()
+        states = {}
+        with open(os.path.join(path, "states.bin"), "rb") as f:
+            # changes of states go to memory, the entry isn't changed; the mapping is closed with the suites
+            mapped = compiled["size"] and mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        for slot_scheme, (offset, size) in zip(slot_schemes, compiled["offsets"]):
+            states[slot_scheme] = MappedStates(mapped, offset, size) if size else ""
+        slots = MultiSchemeSlotSuite(slot_schemes, model=model, states=states)
+        return (model, slots)
+
+    def store (self, model, slots):
+        '''Stores `model` with `slots` (right after generation, before any slot is covered). The entry is written to a temporary directory and renamed, so readers never see a partial entry.'''
+        path = self.get_path(model.yaml_model)
+        if os.path.isdir(path):
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        tmp_path = tempfile.mkdtemp(dir=self.directory)
+        try:
+            compiled = model.get_compiled()
+            compiled["offsets"] = []
+            offset = 0
+            with open(os.path.join(tmp_path, "states.bin"), "wb") as f:
+                for slot_scheme in compiled["slot_schemes"]:
+                    states = slots[SlotScheme(slot_scheme)].states
+                    f.write(states.get_buffer() if isinstance(states, MappedStates) else states)
+                    compiled["offsets"].append((offset, len(states)))
+                    offset += len(states)
+            compiled["size"] = offset
+            with open(os.path.join(tmp_path, "model.pickle"), "wb") as f:
+                pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, path)
+        except:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
@@ -1,3 +1,42 @@
+import time
+import resource
+
+__version__ = "0.1"
+
 class Container (object):
     '''TODO: need to fix slots'''
     pass
+
+def get_memory_usage ():
+    '''Returns resident memory of the process in bytes: the current one from /proc, if it's available, or the peak one.'''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class BudgetExceeded (Exception):
+    '''Is raised, when `Budget` runs out. `reason` is "time" or "memory".'''
+    def __init__ (self, reason):
+        super(BudgetExceeded, self).__init__("%s budget is exceeded" % reason)
+        self.reason = reason
+
+class Budget (object):
+    '''Wall-clock limit (`time_limit` seconds from creation) and memory limit (`memory_limit` bytes of resident memory) of a generation.'''
+    def __init__ (self, time_limit=None, memory_limit=None):
+        self.deadline = None if time_limit is None else time.time() + time_limit
+        self.memory_limit = memory_limit
+
+    def get_exceeded (self, allocate=0):
+        '''Returns "time" or "memory", if the budget is over (or would be over after allocation of `allocate` more bytes), or None.'''
+        if self.deadline is not None and time.time() > self.deadline:
+            return "time"
+        if self.memory_limit is not None and get_memory_usage() + allocate > self.memory_limit:
+            return "memory"
+        return None
+
+    def check (self, allocate=0):
+        '''Raises `BudgetExceeded`, if the budget is over.'''
+        reason = self.get_exceeded(allocate)
+        if reason is not None:
+            raise BudgetExceeded(reason)
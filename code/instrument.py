@@ -0,0 +1,155 @@
+#-*- coding: utf-8 -*-
+import json
+import time
+import resource
+from helpers import get_memory_usage
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+class Instrumentation (object):
+    '''Collects numbers of a generation: per-phase timers, counters and series (one value per test case).
+Phases: parse, scheme_expansion, slot_generation, constraint_marking, seeding, generation.
+Counters: constraint_calls (a vectorized call over a column of slots counts once), candidates_scored. Series: slots_marked (per test case).
+With `trace_memory` memory is taken after each phase: traced memory, if `tracemalloc` is available, current and peak RSS.
+Also current RSS is taken before and after building each structure (see `measure`): slot_states, candidate_index, priority_order, scheme_heap.
+Results are exported by `to_dict`/`to_json`, and `callback` gets the dict, when generation is finished.
+Pass an instance to `Model` (or call `attach`); without it the model uses `disabled`, which does nothing.'''
+    enabled = True
+
+    def __init__ (self, callback=None, trace_memory=False):
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.timers = {} # { phase: seconds }
+        self.counters = {}
+        self.series = {}
+        self.memory = {} # { phase or structure: { measure: value } }
+        if trace_memory and tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def attach (self, model):
+        '''Makes `model` report to the instrumentation: constraint lambdas of the model are wrapped with a counter.'''
+        model.instrumentation = self
+        def counted (func):
+            def wrapper (*args):
+                self.counters["constraint_calls"] = self.counters.get("constraint_calls", 0) + 1
+                return func(*args)
+            return wrapper
+        for kind in ["optional", "mandatory"]:
+            constraints = getattr(model.constraints, kind)
+            for sig in constraints:
+                constraints[sig] = map(counted, constraints[sig])
+        model._plans = {} # plans keep constraint functions
+        return model
+
+    def timer (self, phase):
+        '''Returns context manager, which adds its time to `phase` timer.'''
+        return _Timer(self, phase)
+
+    def add_time (self, phase, seconds):
+        self.timers[phase] = self.timers.get(phase, 0) + seconds
+        if self.trace_memory:
+            self.memory[phase] = self.get_memory()
+
+    def measure (self, structure):
+        '''Returns context manager, which takes current RSS before and after building `structure` (with `trace_memory` only).'''
+        if not self.trace_memory:
+            return _NullTimer()
+        return _Measure(self, structure)
+
+    def add_memory (self, structure, before, after):
+        '''Keeps RSS before the first build of `structure`, after the last one, and growth summed over builds (in bytes).'''
+        memory = self.memory.setdefault(structure, {"rss_before": before, "rss_growth": 0, "builds": 0})
+        memory["rss_after"] = after
+        memory["rss_growth"] += after - before
+        memory["builds"] += 1
+
+    def count (self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def append (self, series, value):
+        self.series.setdefault(series, []).append(value)
+
+    @staticmethod
+    def get_memory ():
+        result = {"rss": get_memory_usage(), "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            result["traced"], result["traced_peak"] = tracemalloc.get_traced_memory()
+        return result
+
+    def finish (self):
+        '''Is called, when generation is finished: passes results to `callback`.'''
+        if self.callback is not None:
+            self.callback(self.to_dict())
+
+    def to_dict (self):
+        return {"timers": dict(self.timers),
+                "counters": dict(self.counters),
+                "series": dict((name, list(values)) for name, values in self.series.iteritems()),
+                "memory": dict(self.memory)}
+
+    def to_json (self, stream=None):
+        '''Returns results as JSON string or writes them to `stream`.'''
+        if stream is None:
+            return json.dumps(self.to_dict(), sort_keys=True)
+        json.dump(self.to_dict(), stream, sort_keys=True)
+
+
+class _Timer (object):
+    def __init__ (self, instrumentation, phase):
+        self.instrumentation = instrumentation
+        self.phase = phase
+
+    def __enter__ (self):
+        self.start = time.time()
+
+    def __exit__ (self, *exc_info):
+        self.instrumentation.add_time(self.phase, time.time() - self.start)
+
+
+class _Measure (object):
+    def __init__ (self, instrumentation, structure):
+        self.instrumentation = instrumentation
+        self.structure = structure
+
+    def __enter__ (self):
+        self.before = get_memory_usage()
+
+    def __exit__ (self, *exc_info):
+        self.instrumentation.add_memory(self.structure, self.before, get_memory_usage())
+
+
+class _NullTimer (object):
+    def __enter__ (self):
+        pass
+
+    def __exit__ (self, *exc_info):
+        pass
+
+
+class NullInstrumentation (object):
+    '''Instrumentation, which does nothing: constraints are not wrapped, and all calls are no-ops.'''
+    enabled = False
+    null_timer = _NullTimer()
+
+    def attach (self, model):
+        model.instrumentation = self
+        return model
+
+    def timer (self, phase):
+        return self.null_timer
+
+    def measure (self, structure):
+        return self.null_timer
+
+    def count (self, counter, value=1):
+        pass
+
+    def append (self, series, value):
+        pass
+
+    def finish (self):
+        pass
+
+disabled = NullInstrumentation()
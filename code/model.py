@@ -3,7 +3,12 @@ import re
 import yaml
 import itertools as it
 from helpers import Container
+from instrument import disabled
 from slot import SlotScheme
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class Model (object):
     '''Initialization with yaml:
@@ -68,10 +73,15 @@ Data after initialization:
     par3__par3_2__par3_2_1: 3
   }
 '''
+    propagation_limit = 10 ** 6 # max number of values combinations of constraint signature to propagate it, see `ConstraintPropagator`
     arg_sep = re.compile("\s*,\s*")
     lambda_signature_re = re.compile("^lambda\s+(.*)\s*:(.*)") # regexp for lambda arguments match
-    def __init__ (self, yaml_model):
-        self.parse(yaml_model)
+    def __init__ (self, yaml_model, instrumentation=None):
+        '''`instrumentation` is `instrument.Instrumentation` object, which collects timers and counters of work with the model.'''
+        instrumentation = instrumentation or disabled
+        with instrumentation.timer("parse"):
+            self.parse(yaml_model)
+        instrumentation.attach(self)
 
     def parse (self, yaml_model):
         def flatten_inner (data):
@@ -91,93 +101,323 @@ Data after initialization:
                 elif isinstance(v, dict):
                     turn_values_to_list(v)
             return data
-            
-        def _parse_constraints (constraints):
-            parsed = {}
-            for c_lambda in constraints:
-                (sig, body) = self.lambda_signature_re.search(c_lambda).groups()
-                sig = ",".join(sorted(self.arg_sep.split(sig)))
-                new_lambda = "lambda %s: %s" % (sig, body)
-                parsed.setdefault(sig, []).append(eval(new_lambda))
-            return parsed
 
         raw_model = yaml.load(yaml_model)
-        self.data = turn_values_to_list(flatten_inner(raw_model["data"]))
-        self.priority = flatten_inner(raw_model.get("priority", {}))
-        self.params = sorted(self.data.keys())
-        self.constraints = Container()
-        if raw_model.has_key("constraints"):
-            for k in ["optional", "mandatory"]:
-                setattr(self.constraints, k, _parse_constraints(raw_model["constraints"].get(k, {})))
-        self.scheme = raw_model["scheme"]
+        constraint_sources = {}
+        for k in ["optional", "mandatory"]:
+            constraint_sources[k] = (raw_model.get("constraints") or {}).get(k) or []
+        self.compile({"yaml_model": yaml_model,
+                      "data": turn_values_to_list(flatten_inner(raw_model["data"])),
+                      "priority": flatten_inner(raw_model.get("priority", {})),
+                      "constraint_sources": constraint_sources,
+                      "scheme": raw_model["scheme"]})
         # if len(self.scheme.keys()) > 1:
         #     self.scheme = { "_1": self.scheme }
 
-    def generate (self):
-        slot_schemes = self.get_slot_schemes() # here we add complex params
-        slots = MultiSlotScheme(*slot_schemes, generate=True, model=self)
-        tests = run_alg(slots) # only complex constraints ????
+    def compile (self, compiled):
+        '''Initializes model from `compiled` dict (result of `parse` or `get_compiled`). Only constraint lambdas are evaluated here.'''
+        self.yaml_model = compiled["yaml_model"]
+        self.data = compiled["data"]
+        self.priority = compiled["priority"]
+        self.scheme = compiled["scheme"]
+        self.slot_schemes = compiled.get("slot_schemes") # see `get_slot_schemes`
+        if self.slot_schemes is not None:
+            self.slot_schemes = map(SlotScheme, self.slot_schemes)
+        self.params = sorted(self.data.keys())
+        self.param_positions = dict((par, i) for i, par in enumerate(self.params))
+        # values are interned: the engine works with codes (positions of values in domains),
+        # values are decoded only for constraint lambdas and for output
+        self.codes = dict((par, dict((val, code) for code, val in enumerate(dom)))
+                          for par, dom in self.data.iteritems())
+        self.code_priorities = dict((par, [self.get_priority(par, val) for val in dom])
+                                    for par, dom in self.data.iteritems())
+        self._plans = {} # compiled constraint plans, see `get_constraint_plan`
+        self._propagators = {} # { signature: ConstraintPropagator or None }
+        self.constraint_sources = compiled["constraint_sources"]
+        self.constraints = Container()
+        for k in ["optional", "mandatory"]:
+            setattr(self.constraints, k, self._parse_constraints(self.constraint_sources[k]))
+
+    @classmethod
+    def from_compiled (cls, compiled, instrumentation=None):
+        model = cls.__new__(cls)
+        instrumentation = instrumentation or disabled
+        with instrumentation.timer("parse"):
+            model.compile(compiled)
+        return instrumentation.attach(model)
+
+    def get_compiled (self):
+        '''Returns dict of picklable model data (without constraint lambdas, they are kept as sources) to restore model with `from_compiled`.'''
+        return {"yaml_model": self.yaml_model,
+                "data": self.data,
+                "priority": self.priority,
+                "constraint_sources": self.constraint_sources,
+                "scheme": self.scheme,
+                "slot_schemes": [tuple(slot_scheme) for slot_scheme in self.get_slot_schemes()]}
+
+    def _parse_constraints (self, constraints):
+        parsed = {}
+        for c_lambda in constraints:
+            (sig, body) = self.lambda_signature_re.search(c_lambda).groups()
+            sig = ",".join(sorted(self.arg_sep.split(sig)))
+            new_lambda = "lambda %s: %s" % (sig, body)
+            parsed.setdefault(sig, []).append(eval(new_lambda))
+        return parsed
+
+    def generate (self, seeds=[]):
+        from proto_alg import TestSuite
+        tests = TestSuite()
+        tests.generate_nwise(self, seeds)
+        return tests
 
     def get_slot_schemes (self):
-        '''Returns list of slot schemes. Some of params of these slots are nested. Values for these params are added to hidded `_data` attribute during execution of this function.'''
-        def reduce_inclusions (list_of_tups):
-            l = len(list_of_tups)
+        '''Returns list of slot schemes. Some of params of these slots are nested. Values for these params are added to hidded `_data` attribute during execution of this function.
+The list is computed once.'''
+        if self.slot_schemes is not None:
+            return list(self.slot_schemes)
+        with self.instrumentation.timer("scheme_expansion"):
+            self._expand_slot_schemes()
+        return list(self.slot_schemes)
+
+    def _expand_slot_schemes (self):
+        bits = {} # { param: bit of param in masks }
+        def get_bit (par):
+            if not bits.has_key(par):
+                bits[par] = 1 << len(bits)
+            return bits[par]
+
+        def get_mask_bits (mask):
             result = []
-            for i in xrange(l):
-                t1 = list_of_tups[i]
-                add = True
-                for j in xrange(i + 1, l):
-                    t2 = list_of_tups[j]
-                    if set(t1).issubset(set(t2)):
-                        add = False
-                        break
-                if add: result.append(t1)
+            while mask:
+                bit = mask & -mask
+                result.append(bit)
+                mask ^= bit
             return result
 
-        def sort_by_size_by_lexi (list_of_tups):
-            return sorted(list_of_tups,
-                          lambda t1, t2: cmp(len(t1), len(t2)) or cmp(t1, t2))
+        def get_keys (mask_bits):
+            '''Keys of `kept_by_key` index for mask with `mask_bits`: its bits and pairs of bits.'''
+            return mask_bits + [b1 | b2 for b1, b2 in it.combinations(mask_bits, 2)]
 
-        def norm_tuple (tup):
-            return tuple(sorted(set(tup)))
+        def reduce_inclusions (masks):
+            '''Drops masks, which are subsets of other masks. Masks of equal size can't include each other, so masks are taken by size from the widest,
+and each one is checked only against wider kept masks, which have its rarest pair of bits (`kept_by_key` index).'''
+            kept_by_key = {}
+            result = []
+            by_size = {}
+            for mask in masks:
+                by_size.setdefault(bin(mask).count("1"), []).append(mask)
+            for size in sorted(by_size, reverse=True):
+                group = []
+                for mask in by_size[size]:
+                    mask_bits = get_mask_bits(mask)
+                    keys = mask_bits if size == 1 else get_keys(mask_bits)[size:]
+                    candidates = min([kept_by_key.get(key, ()) for key in keys], key=len)
+                    if not any(mask & kept == mask for kept in candidates):
+                        group.append((mask, mask_bits))
+                for mask, mask_bits in group:
+                    result.append(mask)
+                    for key in get_keys(mask_bits):
+                        kept_by_key.setdefault(key, []).append(mask)
+            return result
+
+        def decode (mask):
+            return tuple(sorted(par for par, bit in bits.iteritems() if mask & bit))
 
         def recur_model (model):
+            '''Yields masks of param combinations of `model`. Combinations are streamed, only masks of submodels are kept for products.'''
             if isinstance(model, dict):
                 valency = int(model.keys()[0][2:])
-                params = model.values()[0] # list of submodels
-                for i in xrange(len(params)):
-                    params[i] = recur_model(params[i])
-                result = []
+                params = [list(set(recur_model(submodel))) for submodel in model.values()[0]] # masks of submodels
                 for tup_of_lists in it.combinations(params, valency):
-                    result +=  map(lambda l: reduce(lambda res, t: res + t, l, tuple()), # sum (concat) tuples in list `l`
-                                   it.product(*tup_of_lists))
-                return result
+                    for masks in it.product(*tup_of_lists):
+                        yield reduce(lambda res, m: res | m, masks, 0)
             else:
-                return [(model,)]
-        return map(SlotScheme,
-                   reduce_inclusions(
-                       sort_by_size_by_lexi(
-                           map(norm_tuple,
-                               recur_model(self.scheme)))))
+                yield get_bit(model)
+        self.slot_schemes = map(SlotScheme,
+                                sorted(map(decode, reduce_inclusions(set(recur_model(self.scheme)))),
+                                       key=lambda tup: (len(tup), tup)))
     
     def fits_optional_constraints (self, slot):
-        return self._fits_constraints(slot, self.constraints.optional)
+        return self._fits_constraints(slot, "optional")
 
     def fits_mandatory_constraints (self, slot):
-        return self._fits_constraints(slot, self.constraints.mandatory)
-
-    def _fits_constraints (self, slot, constraints):
-        slot_scheme = slot.slot_scheme
-        scheme_set = set(slot_scheme)
-        for sig, func_list in constraints.items():
-            sig_list = sig.split(',')
-            sig_set = set(sig_list)
-            if sig_set.issubset(scheme_set):
-                for func in func_list:
-                    kwargs = {var: slot[var] for var in sig_list}
-                    if not func(**kwargs):
-                        return False
+        return self._fits_constraints(slot, "mandatory")
+
+    def _fits_constraints (self, slot, kind):
+        return self.fits_values(slot.slot_scheme, tuple(slot), kind)
+
+    def fits_values (self, slot_scheme, codes, kind):
+        '''Checks `codes` (tuple of value codes of `slot_scheme` params) with `kind` ('optional' or 'mandatory') constraints.'''
+        for func, positions, domains in self.get_constraint_plan(slot_scheme, kind):
+            if domains is None:
+                args = [codes[i] for i in positions]
+            else:
+                args = [dom[codes[i]] for dom, i in zip(domains, positions)]
+            if not func(*args):
+                return False
         return True
-            
+
+    def get_constraint_plan (self, slot_scheme, kind):
+        '''Returns list of (function, positions, domains) for `kind` ('optional' or 'mandatory') constraints, which params are all in `slot_scheme`.
+`positions` are indexes of constraint arguments in `slot_scheme`, so a constraint is checked with plain positional call.
+Codes of arguments are decoded with `domains` (lists of argument values) or passed as is, if `domains` is None. Plan is compiled once per scheme.'''
+        key = (kind, slot_scheme)
+        if not self._plans.has_key(key):
+            scheme_positions = dict((par, i) for i, par in enumerate(slot_scheme))
+            plan = []
+            for sig, func_list in getattr(self.constraints, kind).iteritems():
+                sig_list = sig.split(',')
+                mask = tuple([scheme_positions.has_key(var) for var in sig_list])
+                positions = tuple([scheme_positions[var] for var in sig_list if scheme_positions.has_key(var)])
+                if all(mask):
+                    domains = tuple([self.data[var] for var in sig_list])
+                    plan += [(func, positions, domains) for func in func_list]
+                elif any(mask) and kind == "mandatory" and self.get_propagator(sig) is not None:
+                    # signature is wider than the scheme: forbid sub-combinations, which can't be completed
+                    plan.append((self.get_propagator(sig).get_checker(mask), positions, None))
+            self._plans[key] = plan
+        return self._plans[key]
+
+    def get_test_case_plan (self, slot_scheme):
+        '''Returns list of (function, positions, domains) for mandatory constraints with any param from `slot_scheme`.
+`positions` are indexes of constraint arguments in `params`, so constraints are checked on the list of test case codes, decoded with `domains`.'''
+        key = ("test_case", slot_scheme)
+        if not self._plans.has_key(key):
+            plan = []
+            for sig, func_list in self.constraints.mandatory.iteritems():
+                sig_list = sig.split(',')
+                if any([var in slot_scheme for var in sig_list]):
+                    positions = tuple([self.param_positions[var] for var in sig_list])
+                    domains = tuple([self.data[var] for var in sig_list])
+                    plan += [(func, positions, domains) for func in func_list]
+            self._plans[key] = plan
+        return self._plans[key]
+
+    def get_propagation_plan (self, slot_scheme):
+        '''Returns list of (ConstraintPropagator, positions) for mandatory constraints with any param from `slot_scheme`.
+`positions` are indexes of constraint arguments in `params`, as in `get_test_case_plan`.'''
+        key = ("propagation", slot_scheme)
+        if not self._plans.has_key(key):
+            plan = []
+            for sig in self.constraints.mandatory:
+                sig_list = sig.split(',')
+                if any([var in slot_scheme for var in sig_list]) and self.get_propagator(sig) is not None:
+                    positions = tuple([self.param_positions[var] for var in sig_list])
+                    plan.append((self.get_propagator(sig), positions))
+            self._plans[key] = plan
+        return self._plans[key]
+
+    def get_forward_plan (self, slot_scheme):
+        '''Returns list of (position, plan) for params, which are not in `slot_scheme`, but share a mandatory constraint with its params.
+`position` is index of the param in `params`, `plan` is `get_test_case_plan` of the param. See forward checking in `TestCase.fits`.'''
+        key = ("forward", slot_scheme)
+        if not self._plans.has_key(key):
+            neighbours = set()
+            for sig in self.constraints.mandatory:
+                sig_list = sig.split(',')
+                if any([var in slot_scheme for var in sig_list]):
+                    neighbours.update([var for var in sig_list if var not in slot_scheme])
+            self._plans[key] = [(self.param_positions[var], self.get_test_case_plan(SlotScheme(var)))
+                                for var in sorted(neighbours)]
+        return self._plans[key]
+
+    def get_propagator (self, sig):
+        '''Returns `ConstraintPropagator` for mandatory constraints with signature `sig` or None, if there are more than `propagation_limit` combinations to check or constraints fail on some of them.'''
+        if not self._propagators.has_key(sig):
+            domains = [self.data[var] for var in sig.split(',')]
+            propagator = None
+            if reduce(lambda res, dom: res * len(dom), domains, 1) <= self.propagation_limit:
+                try:
+                    propagator = ConstraintPropagator(domains, self.constraints.mandatory[sig])
+                except Exception:
+                    propagator = None
+            self._propagators[sig] = propagator
+        return self._propagators[sig]
+
+    def fits_constraints_batch (self, slot_scheme, columns, kind):
+        '''Batched version of `_fits_constraints`: `columns` are numpy arrays of value codes of `slot_scheme` params (one row per slot).
+Each constraint is called once with whole columns of decoded values. If the result is not a boolean array of slots (the lambda can't be vectorized),
+the constraint is called once per distinct combination of its arguments, see `_fits_distinct`.
+Returns numpy boolean array: True for slots, that fit `kind` constraints.'''
+        size = len(columns[0]) if columns else 1
+        result = np.ones(size, dtype=bool)
+        for func, positions, domains in self.get_constraint_plan(slot_scheme, kind):
+            args = [columns[i] for i in positions]
+            fits = None
+            if domains is not None:
+                try:
+                    fits = func(*[_domain_array(dom)[arg] for dom, arg in zip(domains, args)])
+                except Exception:
+                    fits = None
+            if not (isinstance(fits, np.ndarray) and fits.shape == (size,)):
+                fits = self._fits_distinct(func, args, domains, size)
+            result &= fits.astype(bool)
+        return result
+
+    @staticmethod
+    def _fits_distinct (func, args, domains, size):
+        '''Calls `func` for each distinct row of code columns `args` (decoded with `domains`, if they are given) and spreads results over all `size` rows.
+Constraints have few arguments with small domains, so there are much less distinct rows than slots.'''
+        key = np.zeros(size, dtype=np.int64) # mixed-radix number of codes of a row
+        for arg in args:
+            key = key * (int(arg.max()) + 1) + arg
+        distinct, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+        rows = zip(*[arg[first].tolist() for arg in args]) if args else [()]
+        if domains is not None:
+            rows = [[dom[code] for dom, code in zip(domains, row)] for row in rows]
+        fits = np.fromiter((bool(func(*row)) for row in rows), dtype=bool, count=len(distinct))
+        return fits[inverse]
+
+    def get_priority (self, par, val):
+        return self.priority.get("%s__%s" % (par, val), 0)
+
+    def get_code_priority (self, par, code):
+        return self.code_priorities[par][code]
+
+    def encode (self, par, val):
+        '''Returns code of `val` in domain of `par`. Raises KeyError for values out of the domain.'''
+        return self.codes[par][val]
+
+    def decode (self, par, code):
+        return self.data[par][code]
+
     def __getitem__ (self, item):
         return self.data[item]
+
+
+class ConstraintPropagator (object):
+    '''Keeps values combinations, allowed by mandatory constraints with one signature, and their projections on subsets of the signature.
+A partial assignment, which projection is not allowed, can't be completed. So constraints, which are wider than slot schemes, still exclude slots and prune test cases early.'''
+    def __init__ (self, domains, func_list):
+        self.allowed = set() # combinations of value codes
+        for items in it.product(*[list(enumerate(dom)) for dom in domains]):
+            if all([func(*[val for code, val in items]) for func in func_list]):
+                self.allowed.add(tuple([code for code, val in items]))
+        self.projections = {}
+
+    def get_projection (self, mask):
+        '''Returns set of allowed combinations of value codes of signature params, marked True in `mask`.'''
+        if not self.projections.has_key(mask):
+            self.projections[mask] = set([tuple([val for val, used in zip(vals, mask) if used])
+                                          for vals in self.allowed])
+        return self.projections[mask]
+
+    def get_checker (self, mask):
+        '''Returns constraint-like function of value codes of params, marked True in `mask`.'''
+        projection = self.get_projection(mask)
+        return lambda *vals: vals in projection
+
+    def can_complete (self, args, unset):
+        '''Checks, that `args` (value codes of signature params, some of them are `unset`) can be completed to an allowed combination.'''
+        mask = tuple([arg is not unset for arg in args])
+        return tuple([arg for arg in args if arg is not unset]) in self.get_projection(mask)
+
+
+def _domain_array (dom):
+    '''Returns numpy array of domain values. Values of different or complex types are kept as python objects, so they are compared the same way as in per-slot constraints check.'''
+    types = set(map(type, dom))
+    if len(types) == 1 and types.pop() in (int, long, float, bool, str, unicode):
+        return np.array(dom)
+    result = np.empty(len(dom), dtype=object)
+    result[:] = dom
+    return result
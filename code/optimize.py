@@ -0,0 +1,245 @@
+#-*- coding: utf-8 -*-
+import math
+import random
+import logging
+from helpers import Budget
+from slot import Slot, SlotScheme
+from proto_alg import TestCase
+
+class SuiteCoverage (object):
+    '''Per-slot cover counts of a test suite: for each slot of each slot scheme of `model` it keeps the number of test cases, which cover it.
+Test cases are given as rows of value codes in `model.params` order (see `TestCase.codes`). Slots are keyed by (number of scheme, slot index),
+where slot index is the mixed-radix number of slot codes, as in `SingleSchemeSlotSuite`.'''
+    def __init__ (self, model, rows=()):
+        self.model = model
+        self.slot_schemes = model.get_slot_schemes()
+        self.schemes = [] # (columns of scheme params in rows, strides)
+        self.by_column = [[] for par in model.params] # [(number of scheme, stride of the column in it)]
+        for number, slot_scheme in enumerate(self.slot_schemes):
+            strides = []
+            size = 1
+            for par in reversed(slot_scheme):
+                strides.insert(0, size)
+                size *= len(model[par])
+            columns = [model.param_positions[par] for par in slot_scheme]
+            self.schemes.append((columns, strides))
+            for col, stride in zip(columns, strides):
+                self.by_column[col].append((number, stride))
+        self.counts = {}
+        for row in rows:
+            self.add(row)
+
+    def get_keys (self, row):
+        '''Returns keys of slots, covered by `row` (None for unset params).'''
+        keys = []
+        for number, (columns, strides) in enumerate(self.schemes):
+            index = 0
+            for col, stride in zip(columns, strides):
+                if row[col] is None:
+                    break
+                index += row[col] * stride
+            else:
+                keys.append((number, index))
+        return keys
+
+    def get_key (self, number, row):
+        columns, strides = self.schemes[number]
+        return (number, sum([row[col] * stride for col, stride in zip(columns, strides)]))
+
+    def add (self, row):
+        for key in self.get_keys(row):
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def remove (self, row):
+        for key in self.get_keys(row):
+            self.counts[key] -= 1
+
+    def get_unique (self, row):
+        '''Returns keys of slots, which are covered by `row` only.'''
+        return [key for key in self.get_keys(row) if self.counts[key] == 1]
+
+    def get_slot_params (self, key):
+        '''Returns list of (column, code) of the slot with `key`.'''
+        number, index = key
+        columns, strides = self.schemes[number]
+        result = []
+        for col, stride in zip(columns, strides):
+            code, index = divmod(index, stride)
+            result.append((col, code))
+        return result
+
+    def is_optional (self, key):
+        '''Checks, that the slot with `key` breaks optional constraints, so it needn't be covered.'''
+        codes = tuple([code for col, code in self.get_slot_params(key)])
+        return not self.model.fits_values(self.slot_schemes[key[0]], codes, "optional")
+
+    def get_move_keys (self, row, col, code):
+        '''Returns list of (old key, new key) of slots, which change, when `row[col]` is set to `code`.
+New slot index differs from the old one only by the column term, so keys are computed incrementally.'''
+        shift = code - row[col]
+        result = []
+        for number, stride in self.by_column[col]:
+            old_key = self.get_key(number, row)
+            result.append((old_key, (number, old_key[1] + shift * stride)))
+        return result
+
+    def replace (self, old_rows, new_rows):
+        '''Replaces `old_rows` with `new_rows`, if all slots, covered by `old_rows`, stay covered. Returns True, if the replacement is done.'''
+        for row in old_rows:
+            self.remove(row)
+        for row in new_rows:
+            self.add(row)
+        if all([self.counts[key] > 0 for row in old_rows for key in self.get_keys(row)]):
+            return True
+        for row in new_rows:
+            self.remove(row)
+        for row in old_rows:
+            self.add(row)
+        return False
+
+
+def is_valid (model, row):
+    '''Checks, that full test case `row` (value codes in `model.params` order) fits mandatory constraints of `model`.'''
+    return TestCase(model).fits(Slot(tuple(row), SlotScheme(model.params)))
+
+def make_test_case (model, row):
+    test_case = TestCase(model)
+    for par, code in zip(model.params, row):
+        test_case.set_code(par, code)
+    return test_case
+
+def remove_redundant (test_suite, coverage):
+    '''Removes test cases, which cover no slot uniquely, from the first one. Returns number of removed test cases.'''
+    kept = []
+    for test_case in test_suite:
+        if coverage.get_unique(test_case.codes):
+            kept.append(test_case)
+        else:
+            coverage.remove(test_case.codes)
+    removed = len(test_suite) - len(kept)
+    test_suite[:] = kept
+    return removed
+
+def merge_sparse (test_suite, coverage, merge_limit):
+    '''Tries to move unique slots of each test case with at most `merge_limit` unique slots to another test case,
+changing only its params, which are not in its own unique slots, and removes the test case. Returns number of merged test cases.'''
+    model = test_suite.model
+    merged = 0
+    sparse = sorted([test_case for test_case in test_suite if len(coverage.get_unique(test_case.codes)) <= merge_limit],
+                    key=lambda test_case: len(coverage.get_unique(test_case.codes)))
+    for test_case in sparse:
+        # test cases, which were merged or changed by earlier merges, are not in the suite any more
+        positions = [i for i, other in enumerate(test_suite) if other is test_case]
+        if not positions:
+            continue
+        needed = {}
+        for key in coverage.get_unique(test_case.codes):
+            needed.update(coverage.get_slot_params(key))
+        for number, other in enumerate(test_suite):
+            if other is test_case:
+                continue
+            fixed = set([col for key in coverage.get_unique(other.codes) for col, code in coverage.get_slot_params(key)])
+            if any([other.codes[col] != code and col in fixed for col, code in needed.iteritems()]):
+                continue
+            row = other.codes[:]
+            for col, code in needed.iteritems():
+                row[col] = code
+            if not is_valid(model, row) or not coverage.replace([test_case.codes, other.codes], [row]):
+                continue
+            test_suite[number] = make_test_case(model, row)
+            del test_suite[positions[0]]
+            merged += 1
+            break
+    return merged
+
+def compact (test_suite, merge_limit=2):
+    '''Reduction pass over finished `test_suite` (e.g. after `TestSuite.generate_nwise`): keeps cover counts of all slots (see `SuiteCoverage`),
+removes test cases, which cover no slot uniquely, and merges test cases with at most `merge_limit` unique slots into others (see `merge_sparse`),
+while anything is changed. Every slot covered by the suite stays covered, and test cases keep fitting mandatory constraints.
+Works in place and returns `test_suite`.'''
+    coverage = SuiteCoverage(test_suite.model, [test_case.codes for test_case in test_suite])
+    size = len(test_suite)
+    while remove_redundant(test_suite, coverage) + merge_sparse(test_suite, coverage, merge_limit):
+        pass
+    logging.debug("Compaction: %d -> %d test cases", size, len(test_suite))
+    return test_suite
+
+def minimize (test_suite, time_limit=10, max_steps=None, random_seed=0, temperature=1.0, cooling=0.999):
+    '''Local search minimization of full test cases of `test_suite` (e.g. after `TestSuite.generate_nwise`) with simulated annealing.
+Required slots are slots, which are covered by the suite and don't break optional constraints. While all of them are covered,
+the suite is kept as the best one, and the test case with the fewest unique required slots is deleted. Then an uncovered required slot
+is taken at random, and single cells of test cases are changed to its values: moves are scored by the change of the number of uncovered
+required slots (see `SuiteCoverage.get_move_keys`), the best one is taken, a worse one is accepted with probability exp(-delta / temperature).
+Changed test cases keep fitting mandatory constraints. Search stops after `time_limit` seconds or `max_steps` moves.
+Works in place: the suite is replaced with the best suite found, which is returned.'''
+    model = test_suite.model
+    rnd = random.Random(random_seed)
+    budget = Budget(time_limit)
+    rows = [test_case.codes[:] for test_case in test_suite]
+    coverage = SuiteCoverage(model, rows)
+    required = set([key for key, count in coverage.counts.iteritems() if count and not coverage.is_optional(key)])
+    plans = [model.get_test_case_plan(SlotScheme([par])) for par in model.params]
+    uncovered = set()
+    best = None
+    steps = 0
+
+    def fits (row, col, code):
+        old, row[col] = row[col], code
+        try:
+            for func, positions, domains in plans[col]:
+                if not func(*[dom[row[i]] for dom, i in zip(domains, positions)]):
+                    return False
+            return True
+        finally:
+            row[col] = old
+
+    def get_delta (row, col, code):
+        delta = 0
+        for old_key, new_key in coverage.get_move_keys(row, col, code):
+            if coverage.counts[old_key] == 1 and old_key in required:
+                delta += 1
+            if not coverage.counts.get(new_key) and new_key in required:
+                delta -= 1
+        return delta
+
+    def move (row, col, code):
+        for old_key, new_key in coverage.get_move_keys(row, col, code):
+            coverage.counts[old_key] -= 1
+            if not coverage.counts[old_key] and old_key in required:
+                uncovered.add(old_key)
+            coverage.counts[new_key] = coverage.counts.get(new_key, 0) + 1
+            uncovered.discard(new_key)
+        row[col] = code
+
+    while not budget.get_exceeded() and (max_steps is None or steps < max_steps):
+        if not uncovered:
+            best = [row[:] for row in rows]
+            if not rows:
+                break
+            number = min(xrange(len(rows)), key=lambda i: len([key for key in coverage.get_unique(rows[i]) if key in required]))
+            row = rows.pop(number)
+            coverage.remove(row)
+            uncovered.update([key for key in coverage.get_keys(row) if key in required and not coverage.counts[key]])
+            continue
+        steps += 1
+        slot_params = coverage.get_slot_params(rnd.choice(sorted(uncovered)))
+        moves = []
+        for row in rows:
+            diff = [(col, code) for col, code in slot_params if row[col] != code]
+            if len(diff) == 1:
+                moves.append((row,) + diff[0])
+        if not moves:
+            row = rnd.choice(rows)
+            moves = [(row, col, code) for col, code in slot_params if row[col] != code]
+        moves = [(get_delta(*m), rnd.random(), m) for m in moves if fits(*m)]
+        if not moves:
+            continue
+        delta, _, m = min(moves)
+        if delta <= 0 or rnd.random() < math.exp(-delta / temperature):
+            move(*m)
+        temperature = max(temperature * cooling, 0.01)
+    if best is not None:
+        size = len(test_suite)
+        test_suite[:] = [make_test_case(model, row) for row in best]
+        logging.debug("Minimization: %d -> %d test cases in %d steps", size, len(test_suite), steps)
+    return test_suite
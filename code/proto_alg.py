@@ -1,7 +1,13 @@
 #!/usr/bin/python
 #-*- coding: utf-8 -*-
-import re, yaml
-from itertools import combinations
+import sys
+import time
+import random
+import logging
+import multiprocessing
+from model import Model
+from helpers import Budget, BudgetExceeded
+from slot import Slot, SlotScheme, MultiSchemeSlotSuite, get_slots_count
 ## !! Два вида ограничений: НЕЛЬЗЯ и НЕ НУЖНО
 ## ?? Как строить ограничения на слоты из обычных констрэйнтов?
 ## !! Отдельно сделать для невалидных значений
@@ -15,62 +21,358 @@ from itertools import combinations
 ## !! Нужно не забыть, что первая же комбинация из сидов может покрыть и другие сиды !! Нужно вычеркивать поюзанные сиды после генерации тесткейса.
 
 class TestSuite (list):
-    def generate_nwise (self, model, seeds=[]):
+    budget = None # `helpers.Budget` of the current generation, see `check_budget`
+    budget_nodes = 1000 # search nodes of `complete` between budget checks
+    witness = None # value codes of the last row found by `complete`, see `can_complete`
+
+    def generate_nwise (self, model, seeds=[], batched=True, processes=None, random_seed=None,
+                        engine="greedy", candidates=20, slots=None, time_limit=None, memory_limit=None):
+        '''Generates test suite for `model`. With `random_seed` ties between slot candidates are broken randomly (see `generate_best`).
+`engine` is "greedy" (`add_test_case`) or "aetg" (`add_test_case_aetg` with `candidates` test cases per step).
+`slots` is `MultiSchemeSlotSuite` of the model, which was built beforehand (e.g. by `ModelCache`), it's changed during generation.
+`time_limit` (seconds) and `memory_limit` (bytes of resident memory) are budgets of generation: when one of them runs out,
+generation stops and the suite keeps test cases built so far (the test case, which is being built, is dropped;
+seeds, which are not built, are left in `seeds` and their slots are not counted as covered). Then `stopped` is "time" or "memory" (None, if generation is complete),
+and `coverage_report` tells how many slots of each scheme are left uncovered (see `MultiSchemeSlotSuite.get_coverage_report`).'''
+        for test_case in self.iter_nwise(model, seeds, batched, processes, random_seed, engine, candidates, slots,
+                                         time_limit, memory_limit):
+            self.append(test_case)
+        logging.debug("Generated test suite\n%s", self)
+
+    def compact (self, merge_limit=2):
+        '''Removes redundant test cases of the generated suite and merges sparse ones into others (see `optimize.compact`).'''
+        from optimize import compact
+        return compact(self, merge_limit)
+
+    def minimize (self, time_limit=10, max_steps=None, random_seed=0):
+        '''Reduces the generated suite by local search for `time_limit` seconds and keeps the best suite found (see `optimize.minimize`).'''
+        from optimize import minimize
+        return minimize(self, time_limit, max_steps, random_seed)
+
+    def regenerate_nwise (self, model, previous, **kwargs):
+        '''Incremental generation after `model` edits: test cases of `previous` suite (test cases or dicts), which still fit the model (see `get_valid_seeds`), are reused as seeds.
+So they stay in the suite in the same order (only new params get values), and new test cases are generated only for slots they don't cover.
+Other arguments are the same as in `generate_nwise`.'''
+        seeds = self.get_valid_seeds(model, previous)
+        logging.debug("Reused %d of %d previous test cases", len(seeds), len(previous))
+        self.generate_nwise(model, seeds, **kwargs)
+
+    @classmethod
+    def prepare_seeds (cls, model, seeds):
+        '''Bulk seed path (e.g. for seeds read by `suite_io.read_csv`): returns valid seeds (see `get_valid_seeds`) in the same order,
+without empty seeds and seeds, which are subsumed by earlier ones (all their values are in an earlier seed, so are duplicates).'''
+        result = []
+        by_item = {} # { (param, value): set of numbers of kept seeds with it }
+        for seed in cls.get_valid_seeds(model, seeds):
+            items = seed.items()
+            if not items:
+                continue
+            sets = sorted([by_item.get(item, set()) for item in items], key=len)
+            if sets[0] and sets[0].intersection(*sets[1:]):
+                continue
+            for item in items:
+                by_item.setdefault(item, set()).add(len(result))
+            result.append(seed)
+        logging.debug("Prepared %d seeds", len(result))
+        return result
+
+    @staticmethod
+    def get_valid_seeds (model, previous):
+        '''Returns seeds from `previous` test cases, which are valid for `model`: values of removed params are dropped,
+test cases with values out of domains or breaking mandatory constraints (or having no valid values for new params) are dropped too.'''
+        seeds = []
+        for data in previous:
+            seed = Seed((par, val) for par, val in data.iteritems() if model.param_positions.has_key(par))
+            try:
+                codes = dict((par, model.encode(par, val)) for par, val in seed.iteritems())
+            except KeyError:
+                continue
+            if not TestCase(model).fits(Slot(codes, SlotScheme(codes.keys()))):
+                continue
+            seeds.append(seed)
+        return seeds
+
+    def iter_nwise (self, model, seeds=[], batched=True, processes=None, random_seed=None,
+                    engine="greedy", candidates=20, slots=None, time_limit=None, memory_limit=None):
+        '''Generator version of `generate_nwise`: yields each test case as soon as it is built. Test cases are not kept in the suite.
+Timers and counters go to instrumentation of the model (see `Model`), it's finished after the last test case.'''
         self.model = model
-        logging.debug("Starting test suite generation with model\n%s." % model)
+        self.instrumentation = model.instrumentation
+        self.random = None if random_seed is None else random.Random(random_seed)
+        if engine == "aetg" and self.random is None:
+            self.random = random.Random(0)
+        self.random_seed = random_seed
+        logging.debug("Starting test suite generation with model\n%s.", model)
         self.params = model.params
-        self.slots = SlotSuite(model)
-        logging.debug("Slots to fill\n%s" % self.slots)
-        self.constraints = ConstraintSuite(model)
-        logging.debug("Found constraints\n%s" % self.constraints)
-        seeds = self.get_seeds(seeds, constraints)
-        self.seeds = seeds
-        logging.debug("Found seeds\n%s." % "\n".join(map(str, self.seeds)))
-        for s in self.seeds:
-            self.slots.mark_slots_covered(s)
-        logging.debug("Slots after seeds invasion\n%s" % self.slots)
-        while slots.vacant_slots:
-            self.add_test_case()
-        logging.debug("Generated test suite\n%s" % self)
+        self.stopped = self.coverage_report = None
+        budget = None
+        if time_limit is not None or memory_limit is not None:
+            budget = Budget(time_limit, memory_limit)
+        self.budget = budget
+        if slots is None:
+            try:
+                slots = MultiSchemeSlotSuite(model.get_slot_schemes(), generate=True, model=model,
+                                             batched=batched, processes=processes, budget=budget)
+            except BudgetExceeded, e:
+                # slots are not marked with constraints yet, so only their numbers are known
+                logging.warning("Generation is stopped before slots are built: %s", e)
+                self.stopped = e.reason
+                self.coverage_report = dict((slot_scheme, {"total": get_slots_count(model, slot_scheme), "uncovered": None})
+                                            for slot_scheme in model.get_slot_schemes())
+                return
+        self.slots = slots
+        logging.debug("Slots to fill\n%s", self.slots)
+        self.constraints = model.constraints
+        with self.instrumentation.timer("seeding"):
+            seeds = self.get_seeds(seeds, self.constraints)
+            self.seeds = self.get_completable_seeds([TestCase(model, seed) for seed in seeds]) # seeds are encoded once
+            seeded = {} # slots marked in advance for seeds, see `MultiSchemeSlotSuite.unmark_slots`
+            self.slots.mark_slots_covered_bulk([s.codes for s in self.seeds], seeded)
+        built = [] # codes of test cases, which are yielded while seeds are left
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Found seeds\n%s.", "\n".join(map(str, self.seeds)))
+        logging.debug("Slots after seeds invasion\n%s", self.slots)
+        while self.seeds or self.slots.uncovered_count():
+            self.stopped = budget and budget.get_exceeded()
+            if not self.stopped:
+                try:
+                    with self.instrumentation.timer("generation"):
+                        if engine == "aetg":
+                            test_case = self.next_test_case_aetg(candidates)
+                        else:
+                            test_case = self.next_test_case()
+                except BudgetExceeded, e:
+                    # the test case, which was being built, is dropped, its slots are not marked
+                    self.stopped = e.reason
+            if self.stopped:
+                if self.seeds:
+                    # slots of seeds left are not covered yet
+                    self.slots.unmark_slots(seeded, built)
+                logging.warning("Generation is stopped: %s budget is exceeded, %d slots are uncovered", self.stopped, self.slots.uncovered_count())
+                break
+            if test_case is None:
+                break
+            if self.seeds:
+                built.append(test_case.codes)
+            elif seeded:
+                seeded, built = {}, [] # all seeds are built, so their slots are covered
+            yield test_case
+        self.coverage_report = self.slots.get_coverage_report()
+        self.instrumentation.finish()
 
     def add_test_case (self):
+        test_case = self.next_test_case()
+        self.append(test_case)
+        return test_case
+
+    def add_test_case_aetg (self, candidates):
+        test_case = self.next_test_case_aetg(candidates)
+        self.append(test_case)
+        return test_case
+
+    def check_budget (self):
+        '''Raises `helpers.BudgetExceeded`, if the budget of the generation is over. It's checked at each step of building a test case.'''
+        if self.budget is not None:
+            self.budget.check()
+
+    def get_completable_seeds (self, seeds):
+        '''Returns `seeds` (test cases), which can be completed with mandatory constraints (see `complete`), so their slots can be marked covered in advance.
+Other seeds are skipped. If the budget is exceeded, the rest of seeds are kept unchecked: generation stops before they are built.'''
+        result = []
+        for i, seed in enumerate(seeds):
+            try:
+                if self.complete(seed) is None:
+                    logging.warning("Seed %s can't be completed with mandatory constraints, it's skipped", seed)
+                    continue
+            except BudgetExceeded:
+                return result + seeds[i:]
+            result.append(seed)
+        return result
+
+    def next_test_case (self):
+        '''Builds next test case greedily (see `build_test_case`) and marks slots it covers. Returns None, if there is nothing left to cover.
+If the budget is exceeded, the seed, which was being built, is put back to `seeds`.'''
+        while self.seeds or self.slots.uncovered_count():
+            seed = self.seeds.pop(0) if self.seeds else None
+            try:
+                test_case = self.build_test_case(seed)
+            except BudgetExceeded:
+                if seed is not None:
+                    self.seeds.insert(0, seed)
+                raise
+            if test_case is not None:
+                self.instrumentation.append("slots_marked", self.slots.mark_slots_covered(test_case.codes))
+                return test_case
+        return None
+
+    def build_test_case (self, seed=None):
+        '''Builds test case from `seed` or from the most uncovered slot, adding slots greedily.
+Returns None, if the start can't be completed: such a start slot is marked excluded, such a seed is skipped.
+Only slots, after which the test case can still be completed, are added (see `can_complete`), so when no slot fits it, the rest is completed by `complete`.'''
         test_case = TestCase(self.model)
-        if self.seeds:
-            test_case.add(self.seeds.pop())
+        if seed is not None:
+            test_case.add(seed) # it's checked by `get_completable_seeds`
         while not test_case.is_full():
+            self.check_budget()
             cur_slot = None
             if test_case.is_empty():
-                cur_slot = self.slots.get_most_uncovered_slot() # плохое название: здесь слот - значение, а наиболее непокрытый - вид слотов
+                cur_slot = self.slots.get_most_uncovered_slot(self.random) # плохое название: здесь слот - значение, а наиболее непокрытый - вид слотов
+                if cur_slot is not None and seed is None:
+                    if not test_case.fits(cur_slot):
+                        return self.exclude_slot(cur_slot)
+                    start = TestCase(self.model)
+                    start.add(cur_slot)
+                    if self.complete(start) is None:
+                        return self.exclude_slot(cur_slot)
             else:
-                uncovered_params = test_case.get_uncovered_params()
-                # находим все подходящие тест-кейсу слоты, покрывающие хотя бы один его непокрытый параметр
-                slot_candidates = filter(lambda s: test_case.fits(s, self.constraints),
-                                    reduce(lambda res, slots:
-                                           res + slots.get_slots_for_param(),
-                                           uncovered_params, []))
-                if not slot_candidates:
-                    raise PoorModelException("Failed to find slot, fitting test case %s with constraints %s" % (test_case, self.constraints))
-                slot_candidates.sort(
-                    lambda x, y: cmp(test_case.covering_index(x),
-                                     test_case.covering_index(y)) \
-                              or cmp(self.slots.priority(x),
-                                     self.slots.priority(y)))
-                cur_slot = slot_candidates[0]
+                # находим подходящий тест-кейсу слот, покрывающий хотя бы один его непокрытый параметр
+                cur_slot = self.get_best_slot(test_case)
+                if cur_slot is None:
+                    # all slots with uncovered params are covered already, so just fill the test case
+                    cur_slot = self.get_filler(test_case, test_case.get_uncovered_params())
+            if cur_slot is None:
+                # the test case is completable, so it's completed at once
+                cur_slot = self.complete(test_case)
+                if cur_slot is None:
+                    # only an empty start isn't checked
+                    logging.warning("Test case %s can't be completed with mandatory constraints, it's skipped", dict(test_case))
+                    return None
             test_case.add(cur_slot)
-            slots.mark_slots_covered(test_case)
-        self.append(test_case)
+        return test_case
+
+    def get_best_slot (self, test_case):
+        '''Returns uncovered slot with unset params, which fits `test_case` and covers the most uncovered slots with it
+(ranked by `MultiSchemeSlotSuite.rank_candidates`), or None. Slots of schemes with set params of the test case are tried first,
+slots of other schemes are tried only if none of them fits. Constraints are checked in rank order, so only the best slots are checked;
+a slot, after which the test case can't be completed (see `can_complete`), is skipped, so the test case never gets to a dead end.'''
+        for suites in self.slots.get_candidate_suites(test_case.codes):
+            for suite, index in self.slots.rank_candidates(test_case.codes, suites, self.random):
+                slot = suite[index]
+                if test_case.fits(slot, self.constraints) and self.can_complete(test_case, slot):
+                    return slot
+        return None
+
+    def exclude_slot (self, slot):
+        '''Marks excluded `slot`, which can't be completed to a test case with mandatory constraints (though it fits constraints of its scheme).'''
+        logging.debug("Slot %s can't be completed, it's excluded", dict(zip(slot.slot_scheme, slot)))
+        slot.mark_excluded()
+        return None
+
+    def can_complete (self, test_case, slot):
+        '''Checks, that `test_case` with `slot` (which fits it) can be completed with mandatory constraints.
+No search is needed, if the slot agrees with `witness`: the last completed row, which agrees with the test case.'''
+        witness = self.witness
+        if witness is not None and all([witness[self.model.param_positions[par]] == code for par, code in zip(slot.slot_scheme, slot)]) \
+                and all([code is None or code == known for code, known in zip(test_case.codes, witness)]):
+            return True
+        return self.complete(test_case, slot) is not None
+
+    def complete (self, test_case, slot=None):
+        '''Returns slot with values of all unset params of `test_case` (with `slot` added, if it's given), which fit it, or None, if there are no such values.
+Values are searched with backtracking over params (values with higher priority first) in place on a list of codes, each value is checked by `TestCase.fits_codes`.
+The found row is kept as `witness` (see `can_complete`). The budget is checked once per `budget_nodes` search nodes.'''
+        self.check_budget()
+        codes = test_case.codes[:]
+        if slot is not None:
+            for par, code in zip(slot.slot_scheme, slot):
+                codes[self.model.param_positions[par]] = code
+        params = [par for par, code in zip(self.params, codes) if code is None]
+        steps = [(self.model.param_positions[par], SlotScheme(par),
+                  sorted(xrange(len(self.model[par])), key=lambda code: -self.model.get_code_priority(par, code)))
+                 for par in params]
+        nodes = [0]
+        def search (depth):
+            if depth == len(steps):
+                return True
+            nodes[0] += 1
+            if nodes[0] % self.budget_nodes == 0:
+                self.check_budget()
+            pos, slot_scheme, order = steps[depth]
+            for code in order:
+                codes[pos] = code
+                if test_case.fits_codes(codes, slot_scheme) and search(depth + 1):
+                    return True
+            codes[pos] = None
+            return False
+        if not search(0):
+            return None
+        self.witness = codes
+        return Slot(dict((par, codes[self.model.param_positions[par]]) for par in params), SlotScheme(params))
+
+    def next_test_case_aetg (self, candidates):
+        '''AETG-like step: builds `candidates` test cases, scores their new coverage at once (see `MultiSchemeSlotSuite.count_uncovered`) and takes the best one.'''
+        seed = self.seeds.pop(0) if self.seeds else None
+        try:
+            built = filter(None, [self.build_candidate(seed) for i in xrange(candidates)])
+        except BudgetExceeded:
+            if seed is not None:
+                self.seeds.insert(0, seed)
+            raise
+        if not built:
+            # all candidates got stuck in constraints
+            if seed is not None:
+                self.seeds.insert(0, seed)
+            return self.next_test_case()
+        counts = self.slots.count_uncovered([test_case.codes for test_case in built])
+        self.instrumentation.count("candidates_scored", len(built))
+        test_case = built[counts.index(max(counts))]
+        self.instrumentation.append("slots_marked", self.slots.mark_slots_covered(test_case.codes))
+        return test_case
+
+    def build_candidate (self, seed=None):
+        '''Builds candidate test case from `seed` or random most uncovered slot: other params are added in random order, each with value covering most uncovered slots.
+Returns None, if some param has no value fitting constraints.'''
+        test_case = TestCase(self.model)
+        if seed is not None:
+            test_case.add(seed)
+        else:
+            test_case.add(self.slots.get_most_uncovered_slot(self.random) or {})
+        params = test_case.get_uncovered_params()
+        self.random.shuffle(params)
+        for par in params:
+            self.check_budget()
+            scores = self.slots.get_value_scores(test_case.codes, par)
+            order = sorted(xrange(len(self.model[par])),
+                           key=lambda code: (-scores[code], -self.model.get_code_priority(par, code), self.random.random()))
+            slot_scheme = SlotScheme(par)
+            for code in order:
+                slot = Slot((code,), slot_scheme)
+                if test_case.fits(slot):
+                    test_case.add(slot)
+                    break
+            else:
+                return None
+        return test_case
+
+    def get_filler (self, test_case, uncovered_params):
+        '''Returns single-value slot for one of `uncovered_params`, which fits `test_case` and keeps it completable (see `can_complete`), or None.'''
+        for par in uncovered_params:
+            slot_scheme = SlotScheme(par)
+            codes = sorted(xrange(len(self.model[par])),
+                           key=lambda code: -self.model.get_code_priority(par, code))
+            for code in codes:
+                slot = Slot((code,), slot_scheme)
+                if test_case.fits(slot, self.constraints) and self.can_complete(test_case, slot):
+                    return slot
+        return None
 
     def get_seeds (self, init_seeds, constraints, param=None):
         '''Get some initial Seeds (sub-testcases) for generation. Can generate with param or in a random way. Looking for constrain'''
         return init_seeds
 
 class TestCase (dict):
+    '''Dict of param values. The engine works with `codes`: value codes (see `Model.encode`) in `params` order, None for unset params.'''
     def __init__ (self, model, data={}):
-        super(TestCase, self).__init__(data)
+        super(TestCase, self).__init__()
         self.model = model # ссылка на модель 
         self.params = model.params
-        self.size = len(params)
-        self.fullness = len(self)
+        self.size = len(self.params)
+        self.codes = [None] * self.size # for positional constraint checks and slot lookups
+        self.add(data)
+
+    @property
+    def fullness (self):
+        return len(self)
 
     def is_empty (self):
         return self.fullness == 0
@@ -78,171 +380,198 @@ class TestCase (dict):
     def is_full (self):
         return self.fullness == self.size
 
+    def __setitem__ (self, par, val):
+        self.set_code(par, self.model.encode(par, val))
+
+    def set_code (self, par, code):
+        super(TestCase, self).__setitem__(par, self.model.decode(par, code))
+        self.codes[self.model.param_positions[par]] = code
+
     def add (self, data):
         # считаем, что Seed-ами наполняемся так же, как dict-ом.
-        super(TestCase, self).update(data)
+        if isinstance(data, Slot):
+            codes = zip(data.slot_scheme, data)
+        elif isinstance(data, TestCase):
+            codes = [(par, data.codes[data.model.param_positions[par]]) for par in data]
+        else:
+            codes = [(par, self.model.encode(par, val)) for par, val in dict(data).iteritems()]
+        for par, code in codes:
+            self.set_code(par, code)
 
     def get_uncovered_params (self):
-        pass
-                                    
-    def fits (self, slot, constraints=None):
-        pass
+        return [par for par in self.params if par not in self]
 
-    def covering_index (self, slot):
-        pass
+    def fits (self, slot, constraints=None):
+        '''Checks, that `slot` doesn't contradict to values of the test case and that together they don't break mandatory constraints.
+Uses constraint plan of the slot scheme (see `Model.get_test_case_plan`), so checks are positional calls.'''
+        codes = self.codes[:]
+        for par, code in zip(slot.slot_scheme, slot):
+            pos = self.model.param_positions[par]
+            if codes[pos] is None:
+                codes[pos] = code
+            elif codes[pos] != code:
+                return False
+        return self.fits_codes(codes, slot.slot_scheme)
+
+    def fits_codes (self, codes, slot_scheme):
+        '''Checks mandatory constraints with params of `slot_scheme` on `codes` (value codes of the test case with the slot values set), see `fits`.
+`codes` are changed only during the check, so a search can set values in place.'''
+        for func, positions, domains in self.model.get_test_case_plan(slot_scheme):
+            args = [codes[i] for i in positions]
+            if None in args:
+                continue
+            if not func(*[dom[code] for dom, code in zip(domains, args)]):
+                return False
+        # forward checking: partially filled constraints must still be satisfiable
+        for propagator, positions in self.model.get_propagation_plan(slot_scheme):
+            args = [codes[i] for i in positions]
+            if None in args and not propagator.can_complete(args, None):
+                return False
+        # forward checking over all constraints together: each unset param, sharing a constraint with the slot,
+        # must keep a value, which fits all its constraints with set params
+        for pos, plan in self.model.get_forward_plan(slot_scheme):
+            if codes[pos] is None and not self._has_value(codes, pos, plan):
+                return False
+        return True
+
+    def _has_value (self, codes, pos, plan):
+        '''Checks, that some value of param at `pos` fits constraints of `plan` (see `Model.get_forward_plan`), which other params are set in `codes`.'''
+        plan = [(func, positions, domains) for func, positions, domains in plan
+                if all([codes[i] is not None for i in positions if i != pos])]
+        if not plan:
+            return True
+        try:
+            for code in xrange(len(self.model[self.params[pos]])):
+                codes[pos] = code
+                if all(func(*[dom[codes[i]] for dom, i in zip(domains, positions)]) for func, positions, domains in plan):
+                    return True
+            return False
+        finally:
+            codes[pos] = None
 
 class Seed (dict):
     pass
         
 
-class Model (object):
-    '''
-data:
-    par1: [val11, val12]
-    par2: val21
-    par3:
-      par3_1: [val311, val312]
-      par3_2: [val321]
-    par4: [val41, val42]
-scheme:
-    __2:
-    - par3->par_3_1
-    - par1
-    - __3:
-      - par3->par_3_2
-      - par1
-      - par2
-constraints:
-    optional:
-      - "lambda par1, par2: par1 > par2"
-      - "lambda par1, par2: par1 < par2 * 2"
-    mandatory:
-      - "lambda par2, par3, par1, par4: par1 != par3 or par2 != par3"
-priority:
-    par1:
-      val12: 5
-    par3:
-      par3_1:
-        val311: 10
-'''
-    sep = re.compile("\s*,\s*")
-    lambda_signature_re = re.compile("^lambda\s+(.*)\s*:") # regexp for lambda arguments match
-    def __init__ (self, yaml_model):
-        raw_model = yaml.load(yaml_model)
-        self.data = self._normalize_data(raw_model["data"])
-        self.params = self.data.keys()
-        self.constraints = {}
-        if raw_model["constraints"]:
-            for k in ["optional", "mandatory"]:
-                self.constraints[k] = self._parse_constraints(raw_model["constraints"].get(k, []))
-        self.scheme = raw_model["scheme"]
-        # if len(self.scheme.keys()) > 1:
-        #     self.scheme = { "_1": self.scheme }
-        self.priority = self._normalize_priority(raw_model["priority"])
-
-        
-    def _normalize_data (self, data):
-        for k, v in data.items():
-            if isinstance(v, list):
-                pass
-            elif isinstance(v, dict):
-                for kk, vv in self._normalize_data(v).iteritems():
-                    data["%s->%s" % (k, kk)] = vv
-                data.pop(k)
-            else:
-                data[k] = [v]
-        return data
-
-    def _normalize_priority (self, priority):
-        for k, v in priority.iteritems():
-            if isinstance(v, dict):
-                if all(map(lambda x: isinstance(x, dict), v.values())):
-                    sep = "%s->%s" 
-                else:
-                    sep = "%s=%s"
-                for kk, vv in self._normalize_priority(v).iteritems():
-                    new_key = sep % (k, kk)
-                    priority[new_key] = vv
-                    priority.pop(k)
-        return priority
-
-
-    def _parse_constraints (self, constraints):
-        parsed = {}
-        for c_lambda in constraints:
-            sig = ",".join(sorted(self.sep.split(self.lambda_signature_re.search(c_lambda).groups()[0])))
-            if not parsed.has_key(sig):
-                parsed[sig] = []
-            parsed[sig].append(eval(c_lambda))
-        return parsed
-        
-        
-class SlotSuite (object):
-    valency_re = re.compile("_+(\d+)")
-    def __init__ (self, model):
-        self.model = model
-        scheme = model.scheme
-        self.slots = self._gen_slots(scheme)
-        logging.debug("Generated slots suite:\n%s" % self)
-        self.vacant_slots = sum(map(lambda s: s.vacant_slots, self.slots))
-
-    def _gen_slots (self, scheme):
-        result = {} # { (sorted p1, p2, p3): [(v1, v2, v3), ...], ... }
-        valency = scheme.keys()[0]
-        params = scheme.values()[0]
-        p = len(params)
-
-        # заполнить { par1 => [val1, ...], '_sm2' => {result struct} }
-        param_dct = {}
-        for i in xrange(p):
-            par = params[i]
-            if isinstance(par, dict):
-                par_name = "_sm%d" % i
-                params[i] = par_name
-                param_dct[par_name] = self._gen_slots(scheme=par)
-            else:
-                param_dct[par] = model["data"][par]
-
-        def get_next_val(par):
-            next(par)
-        # теперь перебираем комбинации
-        for comb in combinations(p, valency):
-            pars_comb = map(params.__getitem__, comb) # содержит _sm%d - подмодели со словарями
-            pars_line = []
-            for pars in 
-
-
-
-
-        # теперь в param_dct должны лежать параметр: значения, причем некоторые параметры - отсортированные кортежи
-        # нужно в result положить (отсортированный кортеж параметров: значение), раскрывая кортежи из param_dct и подвергая их сортировке с остальными
-                
-
-    def mark_slots_covered (self, seed_or_test_case):
-        pass
-
-    def get_most_uncovered_slot (self):
-        pass
-
-    def get_slots_for_param (self):
-        pass
-
-    def priority(self):
-        pass
-
-
-class Slot (dict):
-    def fits_another_slot (self, slot):
-        pass
-
-
-class ConstraintSuite (SlotSuite):
-    pass
-
 class PoorModelException (Exception):
     pass
 
+def _run_generation (args):
+    '''Runs one randomized generation (in a worker process). Returns random seed, list of test cases as dicts (None, if the generation failed)
+and error message of the failed generation.'''
+    yaml_model, seeds, random_seed = args
+    test_suite = TestSuite()
+    try:
+        test_suite.generate_nwise(Model(yaml_model), seeds, random_seed=random_seed)
+    except Exception, e:
+        logging.warning("Generation with random seed %s failed: %s: %s", random_seed, type(e).__name__, e)
+        return random_seed, None, "%s: %s" % (type(e).__name__, e)
+    return random_seed, map(dict, test_suite), None
+
+def _run_rank (result):
+    random_seed, tests, error = result
+    return (len(tests), random_seed)
+
+def generate_best (model, runs=10, seeds=[], processes=None, time_limit=None, random_seed=0):
+    '''Runs `runs` generations with random seeds `random_seed`, `random_seed` + 1, ... and returns the smallest test suite.
+With `processes` > 1 generations run in parallel worker processes.
+When `time_limit` (seconds) is over, unfinished generations are killed and the best finished one is returned (at least one successful generation
+is always waited for). Failed generations are skipped, `PoorModelException` is raised, only if all of them fail.'''
+    deadline = None if time_limit is None else time.time() + time_limit
+    tasks = [(model.yaml_model, seeds, random_seed + i) for i in xrange(runs)]
+    best = None
+    errors = []
+
+    def add (result):
+        if result[1] is None:
+            errors.append("random seed %s: %s" % (result[0], result[2]))
+            return best
+        return min(best or result, result, key=_run_rank)
+
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.imap_unordered(_run_generation, tasks)
+            for i in xrange(runs):
+                timeout = None
+                if deadline is not None and best is not None:
+                    timeout = max(deadline - time.time(), 0)
+                try:
+                    result = results.next(timeout)
+                except multiprocessing.TimeoutError:
+                    break
+                best = add(result)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for task in tasks:
+            if best is not None and deadline is not None and time.time() > deadline:
+                break
+            best = add(_run_generation(task))
+    if best is None:
+        raise PoorModelException("All %d generations failed: %s" % (runs, "; ".join(errors)))
+    logging.debug("Best of %d runs: %d test cases with random seed %s, %d runs failed", runs, len(best[1]), best[0], len(errors))
+    test_suite = TestSuite([TestCase(model, data) for data in best[1]])
+    test_suite.model = model
+    test_suite.random_seed = best[0]
+    return test_suite
+
+def get_shard_param (model):
+    '''Returns param of slot schemes of `model` with the largest domain (the first one in `params` order), by which slots are split into shards.'''
+    params = set([par for slot_scheme in model.get_slot_schemes() for par in slot_scheme])
+    return max([par for par in model.params if par in params], key=lambda par: (len(model[par]), -model.param_positions[par]))
+
+def generate_shard (model, param, shards, shard, seeds=[], random_seed=0, batched=True):
+    '''Generates test suite for slots of `shard` only (see `MultiSchemeSlotSuite.restrict_to_shard`), e.g. on a separate machine.
+Slots of `seeds` are marked covered, but seeds are not added: they go to the merged suite (see `merge_shards`).
+Random seed of the shard is `random_seed` + `shard`, so the result depends only on arguments.'''
+    slots = MultiSchemeSlotSuite(model.get_slot_schemes(), generate=True, model=model, batched=batched)
+    slots.mark_slots_covered_bulk([TestCase(model, seed).codes for seed in TestSuite.prepare_seeds(model, seeds)])
+    slots.restrict_to_shard(param, shards, shard)
+    test_suite = TestSuite()
+    test_suite.generate_nwise(model, batched=batched, random_seed=random_seed + shard, slots=slots)
+    return test_suite
+
+def _run_shard (args):
+    '''Runs `generate_shard` in a worker process. Returns list of test cases as dicts.'''
+    yaml_model, param, shards, shard, seeds, random_seed, batched = args
+    return map(dict, generate_shard(Model(yaml_model), param, shards, shard, seeds, random_seed, batched))
+
+def merge_shards (model, shard_suites, seeds=[], random_seed=0, batched=True):
+    '''Merges suites of shards (test cases or dicts, in shard order) into one suite: their test cases are kept in order,
+then test cases for `seeds` and for slots, which are left uncovered by all shards, are generated with `random_seed`.
+`seeds` should be valid for `model`, as returned by `TestSuite.prepare_seeds` (see `generate_sharded`).'''
+    test_suite = TestSuite([TestCase(model, data) for shard_suite in shard_suites for data in shard_suite])
+    slots = MultiSchemeSlotSuite(model.get_slot_schemes(), generate=True, model=model, batched=batched)
+    slots.mark_slots_covered_bulk([test_case.codes for test_case in test_suite])
+    logging.debug("%d slots are left uncovered by %d shards", slots.uncovered_count(), len(shard_suites))
+    test_suite.extend(TestSuite().iter_nwise(model, seeds, batched=batched, random_seed=random_seed, slots=slots))
+    test_suite.model = model
+    test_suite.random_seed = random_seed
+    return test_suite
+
+def generate_sharded (model, shards, param=None, seeds=[], processes=None, random_seed=0, batched=True):
+    '''Sharded generation: slots are split into `shards` by value of `param` (see `get_shard_param` by default),
+each shard is generated by `generate_shard` (in parallel worker processes with `processes` > 1), and shards are merged by `merge_shards`.
+Shards and merge are deterministic, so the same arguments give the same suite with any number of processes.'''
+    if param is None:
+        param = get_shard_param(model)
+    seeds = TestSuite.prepare_seeds(model, seeds) # once for shards and merge
+    tasks = [(model.yaml_model, param, shards, shard, seeds, random_seed, batched) for shard in xrange(shards)]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            shard_suites = pool.map(_run_shard, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        shard_suites = map(_run_shard, tasks)
+    logging.debug("Shards by %s: %s test cases", param, map(len, shard_suites))
+    return merge_shards(model, shard_suites, seeds, random_seed, batched)
+
 if __name__ == '__main__':
-    model = Model(Model.__doc__)
-    print "..."
-    print yaml.dump(model.constraints, default_flow_style=False)
+    model = Model(open(sys.argv[1]).read())
+    for test_case in TestSuite().iter_nwise(model):
+        print "\t".join([str(test_case[par]) for par in model.params])
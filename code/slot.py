@@ -1,40 +1,64 @@
 #-*- coding: utf-8 -*-
+import os
+import time
+import mmap
+import heapq
+import shutil
+import tempfile
 import itertools as it
+import multiprocessing
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from helpers import BudgetExceeded
 
 class Slot (tuple):
     '''Slot is an immutable tuple of values for SlotScheme object. 
 It's organized as tuple, because there are lots of them to save, and they are short, so, linear access is rather effective.
 Slot also has a state: 'uncovered', 'covered' or 'excluded'. This state is related to current generation process.
+Slot values are codes of values (see `Model.encode`).
+Slots of `SingleSchemeSlotSuite` are not stored, they are created on demand as views of the suite, which keeps their states.
 '''
     states = ('uncovered', 'covered', 'excluded', 'optional')
 
-    def __new__ (cls, vals, slot_scheme, single_scheme_slot_suite=None):
+    def __new__ (cls, vals, slot_scheme, single_scheme_slot_suite=None, index=None):
         if not isinstance(vals, (tuple, dict)):
             raise TypeError("`vals` argument must be either tuple or dict, but it is %s" % type(vals))
         if len(vals) != len(slot_scheme):
             raise RuntimeError("`vals` length must be equal to %d (due to slot scheme length")
         if isinstance(vals, dict):
-            vals = tuple([vals[k] for k in SlotScheme])
+            vals = tuple([vals[k] for k in slot_scheme])
         obj = tuple.__new__(cls, vals)
         obj.slot_scheme = slot_scheme
         obj.single_scheme_slot_suite = single_scheme_slot_suite
-        obj.state = None
-        obj.mark_uncovered()
+        obj.index = index # position of the slot in `single_scheme_slot_suite`
+        if single_scheme_slot_suite is None:
+            obj._state = None
+            obj.mark_uncovered()
         return obj
-        
+
     def __getitem__ (self, key):
-        return super(Slot, self).__getitem__(self.slot_scheme.index(key))
+        return super(Slot, self).__getitem__(self.slot_scheme.positions[key])
+
+    def _get_state (self):
+        if self.single_scheme_slot_suite is None:
+            return self._state
+        return self.single_scheme_slot_suite.states[self.index]
+
+    def _set_state (self, state):
+        if self.single_scheme_slot_suite is None:
+            self._state = state
+        else:
+            self.single_scheme_slot_suite.set_state(self.index, state)
+
+    # slot of a suite is only a view: its state is stored by the suite
+    state = property(_get_state, _set_state)
 
     def _mark_not_uncovered_method (self, state):
-        if not self.single_scheme_slot_suite is None \
-           and self.is_uncovered():
-            self.single_scheme_slot_suite.uncovered_count -= 1
         self.state = state
 
     def mark_uncovered (self):
-        if not self.single_scheme_slot_suite is None \
-           and not self.is_uncovered():
-            self.single_scheme_slot_suite.uncovered_count += 1
         self.state = 0
 
     def mark_covered (self):
@@ -89,11 +113,13 @@ Slot also has a state: 'uncovered', 'covered' or 'excluded'. This state is relat
 #         return Slot(result, flat_slot_scheme)
 
 class SlotScheme (tuple):
-    '''SlotScheme is an immutable tuple of parameters names.'''
+    '''SlotScheme is an immutable tuple of parameters names. `positions` is a { param: index } dict.'''
     def __new__ (cls, *args):
         if len(args) == 1 and hasattr(args[0], '__iter__'):
             args = args[0]
-        return tuple.__new__(cls, sorted(args))
+        obj = tuple.__new__(cls, sorted(args))
+        obj.positions = dict((par, i) for i, par in enumerate(obj))
+        return obj
 
     # @staticmethod
     # def flatten (slot_scheme):
@@ -103,51 +129,786 @@ class SlotScheme (tuple):
     #     return slot_scheme
 
 
-class SingleSchemeSlotSuite (list):
-    '''SingleSchemeSlotSuite is a suite with slots, that fit one SlotScheme.'''
-    def __init__ (self, slot_scheme, slots=None, generate=False, model=None):
+class SingleSchemeSlotSuite (object):
+    '''SingleSchemeSlotSuite is a suite with slots, that fit one SlotScheme.
+Slot objects are not kept: states of all slots are stored in one `bytearray` (one byte per slot), and slots are created on demand as views.
+Values of generated slots are restored from slot index, because `it.product` order is deterministic:
+index is a mixed-radix number, which digits are codes of slot values (positions in domains of `slot_scheme` params).'''
+    chunk_size = 2 ** 16 # number of slots, checked with constraints at once in batched mode
+
+    def __init__ (self, slot_scheme, slots=None, generate=False, model=None, batched=False, store=None, budget=None):
         self.slot_scheme = slot_scheme
+        self.store = store # `SlotStore` for states of generated slots, they are kept in memory, if it's None
 #        self.slot_scheme = SlotScheme.flatten(slot_scheme)
         self.uncovered_count = 0
+        self.sizes = None # domain sizes of `slot_scheme` params
+        self.strides = None # index weight of each param of `slot_scheme`
+        self.columns = None # positions of `slot_scheme` params in `model.params`, see `get_index_for`
+        self.vals = None # values of slots, if they were given explicitly
+        self.vals_index = None # { values: index } for explicitly given slots
+        self.states = bytearray()
+        self.model = model
+        if model is not None:
+            self.columns = [model.param_positions[par] for par in slot_scheme]
+        self.multi_scheme_slot_suite = None # is notified, when a slot becomes uncovered
+        self.cursor = 0 # there are no uncovered slots before this index
+        self.priority_order = None # see `get_top_uncovered_index`
+        self.priority_pos = 0
+        self.priority_heap = None
+        self.code_priorities = None # priorities of value codes of `slot_scheme` params, see `get_priority`
         if slots is None:
             if generate is True:
-                slots = self.generate(model)
+                self.generate(model, batched, budget=budget)
             else:
-                slots = []
+                self.vals = []
+                self.vals_index = {}
+        else:
+            self.vals = [tuple(slot) for slot in slots]
+            self.vals_index = dict((vals, index) for index, vals in enumerate(self.vals))
+            self.states = bytearray([slot.state for slot in slots])
+            self.uncovered_count = self.states.count('\x00')
+
+    def generate (self, model, batched=False, chunk_size=None, budget=None):
+        '''Marks states of slots for all values combinations with constraints of `model`. Slot objects are not created.
+Combinations are enumerated lazily. With `batched` (needs numpy) constraints are evaluated over columns of `chunk_size` slots at once, see `Model.fits_constraints_batch`.
+With `budget` (`helpers.Budget`) it's checked after each `chunk_size` slots, and `helpers.BudgetExceeded` is raised, when it's over.'''
+        chunk_size = chunk_size or self.chunk_size
+        with model.instrumentation.timer("slot_generation"):
+            self._init_domains(model)
+        with model.instrumentation.timer("constraint_marking"):
+            if batched and np is not None:
+                return self._generate_batched(model, chunk_size, budget)
+            # take cartesian product of domain codes
+            for index, codes in enumerate(it.product(*map(xrange, self.sizes))):
+                if budget is not None and index % chunk_size == 0:
+                    budget.check()
+                if not model.fits_values(self.slot_scheme, codes, "mandatory"):
+                    self.set_state(index, 2)
+                elif not model.fits_values(self.slot_scheme, codes, "optional"):
+                    self.set_state(index, 3)
+        return self
+
+    def _init_domains (self, model, states=None):
+        '''Sets domains of `slot_scheme` params and index layout. All slots are uncovered, if `states` (kept as they are) aren't given.'''
+        self.model = model
+        self.cursor = 0
+        self.priority_order = self.priority_heap = self.code_priorities = None
+        self.vals = self.vals_index = None
+        self.sizes = [len(model[par]) for par in self.slot_scheme]
+        self.columns = [model.param_positions[par] for par in self.slot_scheme]
+        # the last param changes fastest in `it.product`
+        self.strides = []
+        size = 1
+        for dom_size in reversed(self.sizes):
+            self.strides.insert(0, size)
+            size *= dom_size
+        if states is None:
+            self.states = bytearray(size) if self.store is None else self.store.allocate(size)
+        elif len(states) != size:
+            raise RuntimeError("%d states are given for %d slots of %s" % (len(states), size, self.slot_scheme))
         else:
-            slots = slots[:]
-        map(lambda slot: slot.single_scheme_slot_suite == self, slots)
-        super(SingleSchemeSlotSuite, self).__init__(slots)
-
-    def generate (self, model):
-        domains_list = []
-        for par in self.slot_scheme:
-            domains_list.append(model[par])
+            self.states = states
+        self.uncovered_count = len(self.states)
+
+    def restore (self, model, states):
+        '''Sets slots for all values combinations with `states` (e.g. built by `generate` in another process) instead of generating them.
+`MappedStates` (e.g. of a cache entry, mapped with copy on write, see `cache.ModelCache.load`) are kept without copying,
+other states are copied to memory or to the store.'''
+        if self.store is not None:
+            self._init_domains(model)
+            if len(states) != len(self.states):
+                raise RuntimeError("%d states are given for %d slots of %s" % (len(states), len(self.states), self.slot_scheme))
+            self.states[:] = states
+        else:
+            self._init_domains(model, states if isinstance(states, MappedStates) else bytearray(states))
+        self.uncovered_count = self.states.count('\x00')
+        return self
+
+    def _generate_batched (self, model, chunk_size, budget=None):
+        states = self.get_state_array()
+        for start in xrange(0, len(self), chunk_size):
+            if budget is not None:
+                budget.check()
+            stop = min(start + chunk_size, len(self))
+            columns = self.get_columns(start, stop)
+            chunk = states[start:stop]
+            chunk[~model.fits_constraints_batch(self.slot_scheme, columns, "optional")] = 3
+            chunk[~model.fits_constraints_batch(self.slot_scheme, columns, "mandatory")] = 2
+        self.uncovered_count = self.states.count('\x00')
+        return self
+
+    def get_state_array (self):
+        '''Returns states as numpy array of uint8, which shares memory with them (needs numpy).'''
+        if isinstance(self.states, MappedStates):
+            return np.frombuffer(self.states.mapped, dtype=np.uint8, count=len(self.states), offset=self.states.start)
+        return np.frombuffer(self.states, dtype=np.uint8)
+
+    def get_columns (self, start, stop):
+        '''Returns list of numpy arrays with value codes of slots from `start` to `stop` index, one array per param of `slot_scheme`.'''
+        indexes = np.arange(start, stop)
+        return [indexes // stride % dom_size for dom_size, stride in zip(self.sizes, self.strides)]
+
+    def __len__ (self):
+        return len(self.states)
+
+    def __getitem__ (self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("slot index out of range")
+        return Slot(self.get_values(index), self.slot_scheme, self, index)
+
+    def __iter__ (self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def get_values (self, index):
+        '''Returns tuple of value codes of slot with `index`.'''
+        if self.vals is not None:
+            return self.vals[index]
         result = []
-        # take cartesian product of domains list and flatten them
-        for slot in it.product(*domains_list):
-            result.append(Slot(slot, self.slot_scheme))
-        for slot in result:
-            if not model.fits_optional_constraints(slot):
-                slot.mark_optional()
-            if not model.fits_mandatory_constraints(slot):
-                slot.mark_excluded()
-        return result
+        for stride in self.strides:
+            code, index = divmod(index, stride)
+            result.append(code)
+        return tuple(result)
+
+    def get_index (self, codes):
+        '''Returns index of slot with `codes` (value codes in `slot_scheme` order) or None, if there is no such slot.'''
+        if self.vals is not None:
+            return self.vals_index.get(tuple(codes))
+        index = 0
+        for dom_size, stride, code in zip(self.sizes, self.strides, codes):
+            if not 0 <= code < dom_size:
+                return None
+            index += code * stride
+        return index
+
+    def get_index_for (self, codes):
+        '''Returns index of slot, covered by `codes` (value codes in `model.params` order, None for unset params, e.g. `TestCase.codes`),
+or None, if `codes` don't fill the slot scheme.'''
+        codes = [codes[col] for col in self.columns]
+        if None in codes:
+            return None
+        return self.get_index(codes)
+
+    def get_slot (self, vals):
+        index = self.get_index(vals)
+        if index is None:
+            return None
+        return self[index]
+
+    def set_state (self, index, state):
+        '''Sets state of slot with `index` and keeps `uncovered_count` up to date.'''
+        old_state = self.states[index]
+        if old_state == state:
+            return
+        if old_state == 0:
+            self.uncovered_count -= 1
+        elif state == 0:
+            self.uncovered_count += 1
+            self.cursor = min(self.cursor, index)
+            if self.priority_order is not None and self.get_priority(index):
+                heapq.heappush(self.priority_heap, (-self.get_priority(index), index))
+            if self.multi_scheme_slot_suite is not None:
+                self.multi_scheme_slot_suite.push_scheme(self)
+        self.states[index] = state
+
+    def mark_covered_bulk (self, indexes):
+        '''Marks covered slots with `indexes` (numpy array, may have duplicates) at once. Only uncovered slots are changed:
+excluded and optional slots keep their states, so optional slots are not counted as covered.
+Returns array of indexes of slots, which were uncovered before.'''
+        states = self.get_state_array()
+        indexes = np.unique(indexes)
+        uncovered = indexes[states[indexes] == 0]
+        states[uncovered] = 1
+        self.uncovered_count -= len(uncovered)
+        return uncovered
+
+    def get_top_uncovered_index (self, random=None):
+        '''Returns index of uncovered slot with the highest priority (see `Model.get_code_priority`) or None, if there are no uncovered slots.
+Indexes of slots with non-zero priority are sorted once (see `_build_priority_order`), covered ones are skipped, when they get to the top;
+slots, which became uncovered again, are pushed to a small heap. Other slots are found by scanning states from `cursor`,
+or from a random position, if `random` (`random.Random` object) is given.'''
+        if self.uncovered_count == 0:
+            return None
+        if self.priority_order is None:
+            if self.model is None:
+                self._build_priority_order()
+            else:
+                with self.model.instrumentation.measure("priority_order"):
+                    self._build_priority_order()
+        order = self.priority_order
+        while self.priority_pos < len(order) and self.states[int(order[self.priority_pos])] != 0:
+            self.priority_pos += 1
+        heap = self.priority_heap
+        while heap and self.states[heap[0][1]] != 0:
+            heapq.heappop(heap)
+        tops = heap[:1]
+        if self.priority_pos < len(order):
+            index = int(order[self.priority_pos])
+            tops.append((-self.get_priority(index), index))
+        top = min(tops) if tops else None
+        if top is not None and top[0] < 0:
+            return top[1]
+        index = self._find_unprioritized(self.cursor if random is None else random.randrange(len(self)))
+        if index is None and random is not None:
+            index = self._find_unprioritized(self.cursor)
+        if index is None:
+            # only slots with negative priority are left
+            return top[1]
+        return index
+
+    def get_priority (self, index):
+        '''Returns priority of slot with `index`: sum of priorities of its value codes.'''
+        if self.code_priorities is None:
+            return 0
+        return sum([priorities[index // stride % dom_size]
+                    for priorities, stride, dom_size in zip(self.code_priorities, self.strides, self.sizes)])
+
+    def _find_unprioritized (self, start):
+        index = self.states.find('\x00', start)
+        while index != -1 and self.get_priority(index):
+            index = self.states.find('\x00', index + 1)
+        if start == self.cursor:
+            self.cursor = len(self) if index == -1 else index
+        return None if index == -1 else index
+
+    def _build_priority_order (self):
+        '''Sorts indexes of uncovered slots with non-zero priority by priority (the highest first), then by index.
+Priorities are not kept, they are computed from indexes (see `get_priority`). With numpy states are scanned by chunks,
+and the order is an array of indexes, so it takes a few bytes per prioritized slot.'''
+        self.priority_pos = 0
+        self.priority_heap = [] # (-priority, index) of slots, which became uncovered after sorting
+        self.priority_order = []
+        self.code_priorities = None
+        if self.model is None or self.sizes is None:
+            return
+        code_priorities = [self.model.code_priorities[par] for par in self.slot_scheme]
+        if not any(map(any, code_priorities)):
+            return
+        self.code_priorities = code_priorities
+        if np is None:
+            self.priority_order = [index for priority, index in sorted([(-self.get_priority(index), index) for index in self.iter_indexes(0)])
+                                   if priority]
+            return
+        code_priorities = map(np.array, code_priorities)
+        states = self.get_state_array()
+        all_indexes, all_priorities = [], []
+        for start in xrange(0, len(self), self.chunk_size):
+            stop = min(start + self.chunk_size, len(self))
+            priorities = sum([code_priority[column] for code_priority, column in zip(code_priorities, self.get_columns(start, stop))])
+            indexes = np.flatnonzero((priorities != 0) & (states[start:stop] == 0))
+            all_indexes.append(indexes + start)
+            all_priorities.append(priorities[indexes])
+        indexes, priorities = np.concatenate(all_indexes), np.concatenate(all_priorities)
+        self.priority_order = indexes[np.lexsort((indexes, -priorities))]
+
+    def get_uncovered_indexes (self, codes=None):
+        '''Returns indexes of uncovered slots, which don't contradict to `codes` (see `get_index_for`), in increasing order:
+numpy array of indexes or list without numpy. States are the only index: indexes of all such slots make a grid over params,
+which are not set in `codes`, so they are enumerated and their states are checked at once. Costs the size of the grid, no memory is kept.'''
+        if self.sizes is None:
+            # explicitly given slots
+            return [index for index in self.iter_indexes(0)
+                    if codes is None or all([codes[col] in (None, code) for col, code in zip(self.columns, self.get_values(index))])]
+        base = 0
+        free = [] # (domain size, stride) of params, which are not set
+        for col, dom_size, stride in zip(self.columns, self.sizes, self.strides):
+            if codes is not None and codes[col] is not None:
+                base += codes[col] * stride
+            else:
+                free.append((dom_size, stride))
+        if np is None:
+            indexes = [base]
+            for dom_size, stride in free:
+                indexes = [index + code * stride for index in indexes for code in xrange(dom_size)]
+            return [index for index in indexes if self.states[index] == 0]
+        if len(free) == len(self.sizes):
+            return np.flatnonzero(self.get_state_array() == 0)
+        indexes = np.array([base], dtype=np.intp)
+        for dom_size, stride in free:
+            indexes = (indexes[:, None] + np.arange(dom_size) * stride).ravel()
+        return indexes[self.get_state_array()[indexes] == 0]
+
+    def iter_indexes (self, state=0):
+        '''Yields indexes of slots with `state`.'''
+        char = chr(state)
+        index = self.states.find(char)
+        while index != -1:
+            yield index
+            index = self.states.find(char, index + 1)
 
     def get_uncovered (self):
-        return filter(lambda slot: slots.is_uncovered(), self)
-    
+        return [self[index] for index in self.iter_indexes(0)]
+
+
+class MappedStates (object):
+    '''States of slots in a memory mapping with the interface of `bytearray`, which `SingleSchemeSlotSuite` uses:
+items are ints, slices are bytearrays, `find` and `count` take a state char. Pages of the file are read, when they are touched,
+and the OS can drop them, when they are not used, so states of schemes, which are not touched by the current test case, are not kept in memory.
+States are `size` bytes from `start` of `mapped`, so one mapping can keep states of many schemes (see `cache.ModelCache.load`).'''
+    chunk_size = 2 ** 20 # number of states, which are counted at once
+
+    def __init__ (self, mapped, start=0, size=None):
+        self.mapped = mapped
+        self.start = start
+        self.size = len(mapped) - start if size is None else size
+
+    @classmethod
+    def create (cls, path, size):
+        '''Returns states of `size` uncovered slots in a new file at `path`.'''
+        with open(path, "w+b") as f:
+            f.truncate(size)
+            return cls(mmap.mmap(f.fileno(), size))
+
+    def __len__ (self):
+        return self.size
+
+    def _get_position (self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("state index out of range")
+        return self.start + index
+
+    def _get_slice (self, key):
+        start, stop, step = key.indices(self.size)
+        return slice(self.start + start, self.start + stop, step)
+
+    def __getitem__ (self, key):
+        if isinstance(key, slice):
+            return bytearray(self.mapped[self._get_slice(key)])
+        return ord(self.mapped[self._get_position(key)])
+
+    def __setitem__ (self, key, value):
+        if isinstance(key, slice):
+            self.mapped[self._get_slice(key)] = str(value)
+        else:
+            self.mapped[self._get_position(key)] = chr(value)
+
+    def __str__ (self):
+        return self.mapped[self.start:self.start + self.size]
+
+    def get_buffer (self):
+        '''Returns read-only buffer of the states without copying them (e.g. to write them to a file).'''
+        return buffer(self.mapped, self.start, self.size)
+
+    def find (self, char, start=0):
+        index = self.mapped.find(char, self.start + start, self.start + self.size)
+        return -1 if index == -1 else index - self.start
+
+    def count (self, char):
+        stop = self.start + self.size
+        return sum([self.mapped[start:min(start + self.chunk_size, stop)].count(char)
+                    for start in xrange(self.start, stop, self.chunk_size)])
+
+    def close (self):
+        self.mapped.close()
+
+
+class SlotStore (object):
+    '''Out-of-core storage of slot states: each `SingleSchemeSlotSuite`, which is created with the store, keeps its states in `MappedStates` file
+in a scratch directory (a new one in `directory` or in the system temporary directory). `close` removes the files, suites can't be used after it.
+Greedy generation over such suites keeps only per-step data in memory: indexes of uncovered slots of candidate schemes, which are scored
+as numpy arrays (see `MultiSchemeSlotSuite.rank_candidates`), and arrays of indexes of prioritized slots (see `_build_priority_order`).
+Schemes, which share no set param with the test case, are read as a whole, when no other slot fits (see `get_candidate_suites`), so they are paged in then.
+Without numpy they are lists, so generation isn't out of core then.'''
+    def __init__ (self, directory=None):
+        self.directory = tempfile.mkdtemp(prefix="slots-", dir=directory)
+        self.files = []
+
+    def allocate (self, size):
+        '''Returns states of `size` uncovered slots.'''
+        if not size:
+            return bytearray() # empty file can't be mapped
+        states = MappedStates.create(os.path.join(self.directory, "%d.states" % len(self.files)), size)
+        self.files.append(states)
+        return states
+
+    def close (self):
+        for states in self.files:
+            states.close()
+        self.files = []
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc_info):
+        self.close()
+
+
+_worker_model = None # model of a worker process, see `_generate_states`
+
+def _init_worker (yaml_model):
+    global _worker_model
+    from model import Model
+    _worker_model = Model(yaml_model)
+
+def _generate_states (args):
+    '''Generates suites of `slot_schemes` in a worker process and returns list of their states. Constraint lambdas can't be pickled, so the worker parses the model itself.'''
+    slot_schemes, batched = args
+    return [str(SingleSchemeSlotSuite(slot_scheme, generate=True, model=_worker_model, batched=batched).states)
+            for slot_scheme in slot_schemes]
+
+
+def get_slots_count (model, slot_scheme):
+    '''Returns number of slots of `slot_scheme` (one state byte per slot).'''
+    return reduce(lambda res, par: res * len(model[par]), slot_scheme, 1)
+
 
 class MultiSchemeSlotSuite (dict):
-    '''MultiSchemeSlotSuite is a dict of `SingleSchemeSlotSuite` objects'''
-    def __init__ (self, slot_schemes, generate=False, model=None):
-        super(MultiSchemeSlotSuite, self).__init__([
-            (slot_scheme, SingleSchemeSlotSuite(slot_scheme,
-                                                generate=generate,
-                                                model=model)) 
-            for slot_scheme in slot_schemes])
+    '''MultiSchemeSlotSuite is a dict of `SingleSchemeSlotSuite` objects.
+With `processes` > 1 suites are generated in a process pool: each scheme is independent, and only compact states are sent back.
+With `states` ({ slot_scheme: states }) suites are restored without generation.
+With `budget` (`helpers.Budget`) generation raises `helpers.BudgetExceeded`, if memory for states doesn't fit, or when the budget runs out
+(it's checked for each chunk of slots, see `SingleSchemeSlotSuite.generate`).
+With `store` (`SlotStore`) states are kept in memory-mapped files instead of memory, so they don't count for memory budget.'''
+    def __init__ (self, slot_schemes, generate=False, model=None, batched=False, processes=None, states=None, budget=None, store=None):
+        self.model = model
+        with model.instrumentation.measure("slot_states"):
+            if states is not None:
+                # { slot_scheme: states } from another process or from cache
+                with model.instrumentation.timer("slot_generation"):
+                    super(MultiSchemeSlotSuite, self).__init__([
+                        (slot_scheme, SingleSchemeSlotSuite(slot_scheme, store=store).restore(model, states[slot_scheme]))
+                        for slot_scheme in slot_schemes])
+            else:
+                if generate and budget is not None:
+                    budget.check(0 if store is not None else sum([get_slots_count(model, slot_scheme) for slot_scheme in slot_schemes]))
+                if generate and processes > 1:
+                    # workers generate slots and mark them with constraints at once
+                    with model.instrumentation.timer("constraint_marking"):
+                        super(MultiSchemeSlotSuite, self).__init__(
+                            self._generate_parallel(slot_schemes, model, batched, processes, budget, store))
+                else:
+                    super(MultiSchemeSlotSuite, self).__init__()
+                    for slot_scheme in slot_schemes:
+                        self[slot_scheme] = SingleSchemeSlotSuite(slot_scheme,
+                                                                  generate=generate,
+                                                                  model=model,
+                                                                  batched=batched,
+                                                                  store=store,
+                                                                  budget=budget)
+        self.scheme_heap = None # see `get_most_uncovered_slot`
+        self.suites_by_param = {} # { param: [suites of schemes with param] }
+        for slot_scheme in sorted(self):
+            self[slot_scheme].multi_scheme_slot_suite = self
+            for par in slot_scheme:
+                self.suites_by_param.setdefault(par, []).append(self[slot_scheme])
+
+    @staticmethod
+    def _generate_parallel (slot_schemes, model, batched, processes, budget=None, store=None):
+        pool = multiprocessing.Pool(processes, _init_worker, (model.yaml_model,))
+        try:
+            # schemes are sent in chunks, a few per process, so small schemes don't cost a round trip each
+            # (chunks are made here: `imap` with chunksize has no timeout in `next`)
+            slot_schemes = list(slot_schemes)
+            chunk_size = len(slot_schemes) // (processes * 4) or 1
+            chunks = [slot_schemes[i:i + chunk_size] for i in xrange(0, len(slot_schemes), chunk_size)]
+            all_states = pool.imap(_generate_states, [(chunk, batched) for chunk in chunks])
+            result = []
+            for chunk in chunks:
+                timeout = None
+                if budget is not None:
+                    budget.check()
+                    if budget.deadline is not None:
+                        timeout = max(budget.deadline - time.time(), 0)
+                try:
+                    chunk_states = all_states.next(timeout)
+                except multiprocessing.TimeoutError:
+                    raise BudgetExceeded("time")
+                for slot_scheme, states in zip(chunk, chunk_states):
+                    result.append((slot_scheme, SingleSchemeSlotSuite(slot_scheme, store=store).restore(model, states)))
+            return result
+        finally:
+            pool.terminate()
+            pool.join()
 
     def uncovered_count (self):
-        return sum(map(lambda slot_scheme: slot_scheme.uncovered_count(), self))
+        return sum(map(lambda suite: suite.uncovered_count, self.itervalues()))
+
+    def get_coverage_report (self):
+        '''Returns { slot_scheme: { "total": number of slots, "uncovered", "covered", "excluded", "optional": numbers of slots in these states } }.'''
+        report = {}
+        for slot_scheme, suite in self.iteritems():
+            report[slot_scheme] = dict((state, suite.states.count(chr(code))) for code, state in enumerate(Slot.states))
+            report[slot_scheme]["total"] = len(suite)
+        return report
+
+    def restrict_to_shard (self, param, shards, shard):
+        '''Marks covered uncovered slots, which are not of `shard` (number from 0 to `shards` - 1), so generation covers only slots of the shard.
+Slots of schemes with `param` are split by code of its value (code % `shards`). Slots of other schemes are not of any shard:
+most of them are covered by test cases of shards anyway, and the rest are left for the merge (see `proto_alg.merge_shards`).'''
+        for suite in self.itervalues():
+            if param in suite.slot_scheme:
+                pos = suite.slot_scheme.positions[param]
+                is_foreign = lambda indexes: indexes // suite.strides[pos] % suite.sizes[pos] % shards != shard
+            else:
+                is_foreign = lambda indexes: indexes >= 0
+            if np is None:
+                for index in list(suite.iter_indexes(0)):
+                    if is_foreign(index):
+                        suite.set_state(index, 1)
+                continue
+            indexes = np.flatnonzero(suite.get_state_array() == 0)
+            suite.mark_covered_bulk(indexes[is_foreign(indexes)])
+
+    def get_slot (self, slot_scheme, vals):
+        '''Returns slot of `slot_scheme` with `vals` (value codes) or None, if there is no such slot.'''
+        return self[slot_scheme].get_slot(vals)
+
+    def mark_slots_covered (self, codes):
+        '''Marks covered all slots, which are filled by `codes` of a seed or a test case (value codes in `model.params` order, None for unset params).
+Only uncovered slots are changed: excluded and optional slots keep their states. Each scheme has at most one such slot,
+so it costs O(number of schemes). Returns number of slots, which were uncovered before.'''
+        result = 0
+        for suite in self.itervalues():
+            index = suite.get_index_for(codes)
+            if index is not None and suite.states[index] == 0:
+                result += 1
+                suite.set_state(index, 1)
+        return result
+
+    def mark_slots_covered_bulk (self, rows, marked=None):
+        '''Vectorized `mark_slots_covered` for many seeds or test cases: `rows` is a list of their codes.
+For each scheme slot indexes of all rows, which fill the scheme, are computed and marked at once. Returns number of slots, which were uncovered before.
+If `marked` dict is given, indexes of these slots are kept in it by scheme, so they can be marked uncovered again (see `unmark_slots`).'''
+        if np is None or not rows:
+            if marked is None:
+                return sum(map(self.mark_slots_covered, rows))
+            result = 0
+            for row in rows:
+                for suite in self.itervalues():
+                    index = suite.get_index_for(row)
+                    if index is not None and suite.states[index] == 0:
+                        suite.set_state(index, 1)
+                        marked.setdefault(suite.slot_scheme, []).append(index)
+                        result += 1
+            return result
+        rows = np.array([[-1 if code is None else code for code in row] for row in rows], dtype=np.intp)
+        result = 0
+        for suite in self.itervalues():
+            columns = rows[:, suite.columns]
+            columns = columns[(columns >= 0).all(axis=1)]
+            if len(columns):
+                uncovered = suite.mark_covered_bulk(columns.dot(suite.strides))
+                result += len(uncovered)
+                if marked is not None and len(uncovered):
+                    marked[suite.slot_scheme] = uncovered
+        return result
+
+    def unmark_slots (self, marked, rows):
+        '''Marks uncovered again covered slots of `marked` (see `mark_slots_covered_bulk`), which are not filled by `rows` (codes of test cases),
+e.g. slots of seeds, which were marked in advance, but their test cases were not built. Returns number of such slots.'''
+        result = 0
+        for slot_scheme, indexes in marked.iteritems():
+            suite = self[slot_scheme]
+            filled = set([suite.get_index_for(row) for row in rows])
+            for index in indexes:
+                index = int(index)
+                if index not in filled and suite.states[index] == 1:
+                    suite.set_state(index, 0)
+                    result += 1
+        return result
+
+    def get_candidate_suites (self, codes):
+        '''Returns two lists of suites of schemes with unset params of `codes` (value codes of a test case): the first one is of schemes,
+which intersect with set params, the second one is of other schemes with the first unset param. Slots of the second list are only needed,
+if no slot of the first one fits the test case. Uncovered slots of such schemes are found by scanning all their states
+(see `get_uncovered_indexes`), so only schemes of one param are taken: the test case goes on with it and other schemes become near ones.'''
+        near, far = [], []
+        seen = set()
+        first = None
+        for par, code in zip(self.model.params, codes):
+            if code is not None:
+                continue
+            if first is None:
+                first = par
+            for suite in self.suites_by_param.get(par, []):
+                if suite.slot_scheme in seen:
+                    continue
+                seen.add(suite.slot_scheme)
+                if any([codes[col] is not None for col in suite.columns]):
+                    near.append(suite)
+                elif first in suite.slot_scheme:
+                    far.append(suite)
+        return near, far
+
+    def rank_candidates (self, codes, suites, random=None):
+        '''Yields (suite, index) of uncovered slots of `suites`, which don't contradict to `codes`, from the best one:
+by number of uncovered slots, which become covered with the slot (see `get_covering_counts`), then by priority.
+Ties are taken in order of suites and indexes or randomly with `random` (`random.Random` object).
+Slots are not created: indexes of each suite are scored as numpy arrays.'''
+        with self.model.instrumentation.measure("candidate_index"):
+            candidates = [(suite, suite.get_uncovered_indexes(codes)) for suite in suites]
+            candidates = [(suite, indexes) for suite, indexes in candidates if len(indexes)]
+            count = sum([len(indexes) for suite, indexes in candidates])
+            tables = {}
+            order = []
+            if count and np is None:
+                order = [(-self.get_covering_counts(codes, suite, index, tables), -self.get_priorities(suite, index),
+                          random.random() if random is not None else 0, suite, index)
+                         for suite, indexes in candidates for index in indexes]
+                order.sort(key=lambda item: item[:3]) # sort is stable
+            elif count:
+                scores = np.concatenate([self.get_covering_counts(codes, suite, indexes, tables) for suite, indexes in candidates])
+                priorities = np.concatenate([self.get_priorities(suite, indexes) for suite, indexes in candidates])
+                if random is None:
+                    ties = np.arange(count)
+                else:
+                    ties = np.random.RandomState(random.randrange(2 ** 32)).permutation(count)
+                offsets = np.cumsum([0] + [len(indexes) for suite, indexes in candidates])
+                order = np.lexsort((ties, -priorities, -scores)).tolist()
+        self.model.instrumentation.count("candidates_scored", count)
+        if np is None:
+            for score, priority, tie, suite, index in order:
+                yield suite, index
+            return
+        for position in order:
+            number = int(np.searchsorted(offsets, position, side="right")) - 1
+            suite, indexes = candidates[number]
+            yield suite, int(indexes[position - offsets[number]])
+
+    def get_covering_counts (self, codes, suite, indexes, tables=None):
+        '''Returns numbers of uncovered slots, which become covered, if slots of `suite` with `indexes` (numpy array or one index) are added to `codes`:
+slots of other schemes, which are fully set then and uncovered. The number depends only on values of unset params of the slot, so it's taken from `get_covering_table`
+of these params; `tables` is a dict to keep the tables between calls with the same `codes`.'''
+        columns = tuple(sorted([col for col in suite.columns if codes[col] is None]))
+        if tables is None:
+            tables = {}
+        if not tables.has_key(columns):
+            tables[columns] = self.get_covering_table(codes, columns)
+        table, strides = tables[columns]
+        keys = 0
+        for col, stride, dom_size in zip(suite.columns, suite.strides, suite.sizes):
+            if strides.has_key(col):
+                keys = keys + indexes // stride % dom_size * strides[col]
+        return table[keys]
+
+    def get_covering_table (self, codes, columns):
+        '''Returns (table, { column: stride }): numbers of uncovered slots, which become covered, if unset params at `columns` of `codes` are set,
+for each combination of their values (table index is the mixed-radix number of value codes with the strides). Those are slots of schemes
+with any of the params, whose other params are set. With numpy the table is computed as an array at once, each scheme costs one lookup.'''
+        strides = {}
+        size = 1
+        for col in reversed(columns):
+            strides[col] = size
+            size *= len(self.model[self.model.params[col]])
+        sizes = dict((col, len(self.model[self.model.params[col]])) for col in columns)
+        if np is None:
+            return [self._count_covered(codes, columns, dict((col, index // strides[col] % sizes[col]) for col in columns))
+                    for index in xrange(size)], strides
+        grid = np.arange(size)
+        return self._count_covered(codes, columns, dict((col, grid // strides[col] % sizes[col]) for col in columns)), strides
+
+    def _count_covered (self, codes, columns, values):
+        counts = 0 if np is None else np.zeros(len(values[columns[0]]), dtype=np.intp)
+        seen = set()
+        for col in columns:
+            for other in self.suites_by_param[self.model.params[col]]:
+                if other.slot_scheme in seen:
+                    continue
+                seen.add(other.slot_scheme)
+                other_indexes = 0
+                for other_col, stride in zip(other.columns, other.strides):
+                    if values.has_key(other_col):
+                        other_indexes = other_indexes + values[other_col] * stride
+                    elif codes[other_col] is not None:
+                        other_indexes = other_indexes + codes[other_col] * stride
+                    else:
+                        break
+                else:
+                    if np is None:
+                        counts += other.states[other_indexes] == 0
+                    else:
+                        counts += other.get_state_array()[other_indexes] == 0
+        return counts
+
+    def get_priorities (self, suite, indexes):
+        '''Returns priorities of slots of `suite` with `indexes` (numpy array or one index), see `priority`.'''
+        result = 0
+        for par, stride, dom_size in zip(suite.slot_scheme, suite.strides, suite.sizes):
+            priorities = self.model.code_priorities[par]
+            if np is None:
+                result += priorities[indexes // stride % dom_size]
+            else:
+                result = result + np.array(priorities)[indexes // stride % dom_size]
+        return result
+
+    def get_most_uncovered_slot (self, random=None):
+        '''Returns the highest priority uncovered slot of the scheme with the most uncovered slots or None, if all slots are covered.
+Schemes are kept in a heap by `uncovered_count`; entries, which became stale after slots were covered, are fixed lazily, when they get to the top.
+With `random` (`random.Random` object) ties between schemes are broken randomly, and a random slot is taken among slots without priority.'''
+        if self.scheme_heap is None:
+            with self.model.instrumentation.measure("scheme_heap"):
+                self.scheme_heap = [(-suite.uncovered_count, slot_scheme) for slot_scheme, suite in self.iteritems()]
+                heapq.heapify(self.scheme_heap)
+        top = self._get_valid_top()
+        if top is None:
+            return None
+        if random is None:
+            suite = self[top[1]]
+        else:
+            # pop all schemes with the same count to choose one of them
+            tied = []
+            while self._get_valid_top() is not None and self.scheme_heap[0][0] == top[0]:
+                tied.append(heapq.heappop(self.scheme_heap))
+            for entry in tied:
+                heapq.heappush(self.scheme_heap, entry)
+            suite = self[random.choice(sorted(set([slot_scheme for count, slot_scheme in tied])))]
+        return suite[suite.get_top_uncovered_index(random)]
+
+    def _get_valid_top (self):
+        '''Returns top (-uncovered_count, slot_scheme) entry of `scheme_heap`, which is up to date, or None, if there are no uncovered slots.'''
+        heap = self.scheme_heap
+        while heap:
+            count, slot_scheme = heap[0]
+            uncovered_count = self[slot_scheme].uncovered_count
+            if -count == uncovered_count:
+                return heap[0] if uncovered_count else None
+            heapq.heappop(heap)
+            if uncovered_count < -count:
+                # entries for grown counts are pushed by `push_scheme`
+                heapq.heappush(heap, (-uncovered_count, slot_scheme))
+        return None
+
+    def push_scheme (self, suite):
+        '''Notifies heap of schemes, that `uncovered_count` of `suite` has grown.'''
+        if self.scheme_heap is not None:
+            heapq.heappush(self.scheme_heap, (-suite.uncovered_count, suite.slot_scheme))
+
+    def count_uncovered (self, rows):
+        '''Returns list with number of uncovered slots, covered by each of `rows` (value codes of full test cases in `model.params` order, e.g. `TestCase.codes`).
+All rows are scored at once: for each scheme slot indexes of all rows are computed and looked up in suite states as numpy arrays.'''
+        if np is None:
+            return [sum([suite.states[sum([row[col] * stride for col, stride in zip(suite.columns, suite.strides)])] == 0
+                         for suite in self.itervalues()])
+                    for row in rows]
+        rows = np.asarray(rows, dtype=np.intp).reshape(len(rows), len(self.model.params))
+        counts = np.zeros(len(rows), dtype=int)
+        for suite in self.itervalues():
+            indexes = rows[:, suite.columns].dot(suite.strides)
+            counts += suite.get_state_array()[indexes] == 0
+        return counts.tolist()
+
+    def get_value_scores (self, codes, param):
+        '''Returns list with number of uncovered slots, which become covered, if `param` with each code of its domain is added to `codes`.
+Only schemes, which other params are all set in `codes`, are taken into account.'''
+        dom_size = len(self.model[param])
+        scores = [0] * dom_size
+        for suite in self.suites_by_param.get(param, []):
+            base = 0
+            for par, col, stride in zip(suite.slot_scheme, suite.columns, suite.strides):
+                if par == param:
+                    param_stride = stride
+                elif codes[col] is not None:
+                    base += codes[col] * stride
+                else:
+                    break
+            else:
+                states = suite.states[base:base + param_stride * dom_size:param_stride]
+                scores = [score + (state == 0) for score, state in zip(scores, states)]
+        return scores
 
 
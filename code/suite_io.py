@@ -0,0 +1,50 @@
+#-*- coding: utf-8 -*-
+import csv
+import json
+
+def encode_cell (val):
+    '''Returns CSV cell of value `val`: `csv` module of Python 2 writes only byte strings, so unicode values (e.g. of YAML models) are encoded as UTF-8.'''
+    if isinstance(val, unicode):
+        return val.encode("utf-8")
+    return val
+
+def get_cell_codes (model, par):
+    '''Returns { CSV cell: value code } for domain values of `par`: cells are string forms of values, unicode values are encoded as UTF-8 (see `encode_cell`).'''
+    return dict((str(encode_cell(val)), code) for code, val in enumerate(model[par]))
+
+def write_csv (test_cases, stream, params, dialect="excel"):
+    '''Writes `test_cases` (any iterable, e.g. `TestSuite.iter_nwise`) to `stream` as CSV with header of `params`.
+Each row is flushed as soon as its test case arrives, so readers can start while generation goes on. Returns number of written test cases.
+Unicode params and values are written as UTF-8 (see `encode_cell`).'''
+    writer = csv.writer(stream, dialect=dialect)
+    writer.writerow(map(encode_cell, params))
+    stream.flush()
+    count = 0
+    for test_case in test_cases:
+        writer.writerow([encode_cell(test_case[par]) for par in params])
+        stream.flush()
+        count += 1
+    return count
+
+def write_jsonl (test_cases, stream, params=None):
+    '''Writes `test_cases` to `stream` as JSON lines: one { param: value } object per test case (only `params`, if they are given).
+Each line is flushed as soon as its test case arrives. Returns number of written test cases.'''
+    count = 0
+    for test_case in test_cases:
+        if params is not None:
+            test_case = dict((par, test_case[par]) for par in params)
+        stream.write(json.dumps(test_case, sort_keys=True) + "\n")
+        stream.flush()
+        count += 1
+    return count
+
+def read_csv (stream, model, dialect="excel"):
+    '''Reads seeds (or test cases) from CSV with header of params, e.g. written by `write_csv`. Yields { param: value } dicts.
+Empty cells are unset params, columns of params, which are not in `model`, are skipped. Cells are matched with domain values by their string form
+(see `get_cell_codes`); other cells are kept as strings, so seeds with them are dropped by `TestSuite.prepare_seeds`.'''
+    reader = csv.reader(stream, dialect=dialect)
+    header = reader.next()
+    by_cell = dict((par, get_cell_codes(model, par)) for par in header if model.param_positions.has_key(par))
+    for row in reader:
+        yield dict((par, model[par][by_cell[par][cell]] if by_cell[par].has_key(cell) else cell)
+                   for par, cell in zip(header, row) if cell != "" and by_cell.has_key(par))
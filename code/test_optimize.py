@@ -0,0 +1,32 @@
+#-*- coding: utf-8 -*-
+import unittest
+from benchmark import build_yaml_model
+from model import Model
+from proto_alg import TestSuite
+from optimize import SuiteCoverage, compact, is_valid
+
+class CompactTest (unittest.TestCase):
+    def check_compact (self, yaml_model, random_seed, merge_limit):
+        model = Model(yaml_model)
+        test_suite = TestSuite()
+        test_suite.generate_nwise(model, random_seed=random_seed)
+        covered = set(SuiteCoverage(model, [test_case.codes for test_case in test_suite]).counts)
+        compact(test_suite, merge_limit)
+        rows = [test_case.codes for test_case in test_suite]
+        coverage = SuiteCoverage(model, rows)
+        self.assertTrue(covered <= set([key for key, count in coverage.counts.iteritems() if count]))
+        self.assertTrue(all([is_valid(model, row) for row in rows]))
+        self.assertEqual(len(set(map(id, test_suite))), len(test_suite))
+
+    def test_merged_test_case_is_not_merged_again (self):
+        # a test case, which was replaced by a merge, used to be merged again as a stale object
+        self.check_compact(build_yaml_model(8, 2, "__2", 0.0, 0), 0, 3)
+
+    def test_models (self):
+        for params, domain, scheme, density in [(5, 3, "__2", 0.1), (8, 2, "__3", 0.0), (10, 2, "__2", 0.25)]:
+            for random_seed in xrange(3):
+                for merge_limit in [2, 3]:
+                    self.check_compact(build_yaml_model(params, domain, scheme, density), random_seed, merge_limit)
+
+if __name__ == '__main__':
+    unittest.main()
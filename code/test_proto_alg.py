@@ -0,0 +1,37 @@
+#-*- coding: utf-8 -*-
+import unittest
+import itertools as it
+from model import Model
+from proto_alg import TestSuite
+
+# no test case has a=1 and b=1, so a seed with them can't be completed
+CONSTRAINED_MODEL = '''data:
+    a: [0, 1]
+    b: [0, 1]
+    c: [0, 1]
+    d: [0, 1]
+    e: [0, 1]
+scheme:
+    __2: [a, b, c, d, e]
+constraints:
+    mandatory:
+      - "lambda a, c: a == 0 or c == 0"
+      - "lambda b, d: b == 0 or d == 0"
+      - "lambda c, d: c == 1 or d == 1"
+'''
+
+class SeedTest (unittest.TestCase):
+    def test_seed_which_cant_be_completed (self):
+        # slots of such a seed used to be marked covered, though no test case covered them
+        model = Model(CONSTRAINED_MODEL)
+        test_suite = TestSuite()
+        test_suite.generate_nwise(model, seeds=[{"a": 1, "b": 1, "e": 0}])
+        covered = set()
+        for test_case in test_suite:
+            covered.update(it.combinations(sorted(test_case.items()), 2))
+        self.assertTrue(((("b", 1), ("e", 0))) in covered)
+        self.assertFalse(any([test_case["a"] == 1 and test_case["b"] == 1 for test_case in test_suite]))
+        self.assertEqual(test_suite.coverage_report[("a", "b")]["covered"], 3)
+
+if __name__ == '__main__':
+    unittest.main()
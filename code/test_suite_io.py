@@ -0,0 +1,48 @@
+#-*- coding: utf-8 -*-
+import unittest
+from StringIO import StringIO
+from model import Model
+from proto_alg import TestSuite
+from suite_io import write_csv, read_csv
+from analyze import analyze_csv
+
+UNICODE_MODEL = u'''data:
+    os: [линукс, win]
+    br: [ff, хром]
+scheme:
+    __2: [os, br]
+'''
+
+class WriteCsvTest (unittest.TestCase):
+    def test_unicode_values (self):
+        # YAML gives unicode values, which the csv module can't write as they are
+        model = Model(UNICODE_MODEL)
+        test_suite = TestSuite()
+        test_suite.generate_nwise(model)
+        stream = StringIO()
+        self.assertEqual(write_csv(test_suite, stream, ["os", "br"]), len(test_suite))
+        rows = set(stream.getvalue().splitlines()[1:])
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(u"линукс,хром".encode("utf-8") in rows)
+
+class ReadCsvTest (unittest.TestCase):
+    def test_unicode_values (self):
+        # string forms of unicode domain values used to break reading of any CSV
+        model = Model(UNICODE_MODEL)
+        self.assertEqual(list(read_csv(StringIO("os,br\nwin,ff\n"), model)), [{"os": "win", "br": "ff"}])
+        test_suite = TestSuite()
+        test_suite.generate_nwise(model)
+        stream = StringIO()
+        write_csv(test_suite, stream, ["os", "br"])
+        stream.seek(0)
+        self.assertEqual(list(read_csv(stream, model)), [dict(test_case) for test_case in test_suite])
+
+class AnalyzeCsvTest (unittest.TestCase):
+    def test_unicode_values (self):
+        model = Model(UNICODE_MODEL)
+        stream = StringIO("os,br\nwin,ff\n" + u"линукс,хром\n".encode("utf-8"))
+        report = analyze_csv(stream, model).get_coverage_report()
+        self.assertEqual(report[("br", "os")]["covered"], 2)
+
+if __name__ == '__main__':
+    unittest.main()